@@ -56,115 +56,3647 @@
 # 08/10/2012 - 1.4.1 - Courgette
 # - fix support for BF3
 #
+# 17/10/2026 - 1.5
+# - task commands are compiled once at load time instead of being read from
+#     the XML config on each run
 #
-__version__ = '1.4.1'
+# 17/10/2026 - 1.6
+# - tasks are kept in a single heap ordered by next fire time and run from
+#     one scheduler thread instead of registering one crontab per task
+#
+# 17/10/2026 - 1.7
+# - cron schedules are compiled into bitmasks and their next occurrence is
+#     computed directly. Ranges with steps, N/M steps and month/day names are
+#     now supported
+#
+# 17/10/2026 - 1.8
+# - task hours are evaluated in a real timezone which follows daylight saving
+#     time changes. Add the timezone setting (local or tz database name)
+# - fix hour ranges and lists being mis-converted to UTC
+#
+# 17/10/2026 - 1.9
+# - reloading the config only touches added, removed or modified tasks
+#
+# 17/10/2026 - 1.10
+# - tasks run on a pool of worker threads (workers and max_queued_runs
+#     settings) so a slow server does not delay other tasks
+# - add the overlap task attribute (skip, queue or concurrent)
+#
+# 17/10/2026 - 1.11
+# - delayed restart tasks are run by the scheduler thread instead of one timer
+#     thread each, and are cancelled on reload and shutdown
+#
+# 17/10/2026 - 1.12
+# - add rcon_batch, rcon_rate and rcon_burst settings to merge rcon commands
+#     sent at the same time and limit the rate of rcon packets
+#
+# 17/10/2026 - 1.13
+# - frostbite commands of a task are pipelined on BF3 and their responses
+#     matched by sequence number (frostbite_pipelining setting)
+#
+# 17/10/2026 - 1.14
+# - add per task run metrics (runs, skipped runs, lateness and command latency histograms)
+# - add the !schedstats command and the stats_file and stats_interval settings to dump metrics as JSON
+#
+# 17/10/2026 - 1.15
+# - add benchmarks on a virtual clock (python scheduler.py bench [--game name] [--max-<metric> value ...] [--baseline file [--tolerance 0.2]] [number of tasks ...]) : load time and memory, scheduler cpu per tick, fire time drift, reload cost and throughput against a slow rcon endpoint
+#
+# 17/10/2026 - 1.16
+# - add a schedule simulator (python scheduler.py simulate [--game name] scheduler.xml [days]) reporting runs per minute, busiest minutes, tasks firing in the same second and the number of server commands
+# - cron occurrences of a whole day are generated at once when no daylight saving change happens that day
+#
+# 17/10/2026 - 1.17
+# - add the jitter setting and task attribute to spread tasks over a time window with a stable delay per task and game server
+#
+# 17/10/2026 - 1.18
+# - add the journal_file setting to save the last run of each task and catch up runs missed while B3 was stopped
+# - add the misfire setting and task attribute (once, all or skip)
+#
+# 17/10/2026 - 1.19
+# - add task conditions (min_players, max_players, map, gametype and plugin_enabled attributes) checked against a cached game state (state_ttl setting)
+#
+# 17/10/2026 - 1.20
+# - add the idempotent attribute to rcon commands and tasks : cvars are not set again while they still have the value B3 last set
+#
+# 17/10/2026 - 1.21
+# - add on_event tasks run when B3 receives given events, with optional debounce and cooldown delays
+#
+# 17/10/2026 - 1.22
+# - commands sent to the game server time out (command_timeout) and are retried with an exponential backoff (command_retries, command_backoff)
+# - after too many failed commands in a row the game server is considered unreachable and tasks are deferred until it answers again (circuit_threshold, circuit_reset)
+#
+# 17/10/2026 - 1.23
+# - tasks use __slots__, and identical cron schedules and commands are shared between tasks, halving load time and memory for large task sets
+# - the plugins of enable_plugin and disable_plugin commands are looked up when first used and checked once on startup, so plugins loaded after the scheduler can be used
+#
+# 17/10/2026 - 1.24
+# - fleet mode : tasks with a servers attribute are sent to the game servers declared with <server> elements, by name or group, all at once over a bounded pool of rcon and frostbite connections (fleet_connections setting)
+# - add the !schedfleet command and per server results in the stats_file
+# - add a fleet test against local stand-in servers (python scheduler.py fleet [number of servers]). It checks what each server received, per server errors, circuit breakers and the connection count, and exits with status 1 on failure
+#
+# 17/10/2026 - 1.25
+# - add the lease_file, lease_backend and lease_ttl settings : standby B3 instances elect through a lease kept in a locked file or a SQLite database the one instance running tasks
+#
+# 17/10/2026 - 1.26
+# - add the !schedlist, !schednext, !schedpause, !schedresume and !schedrun commands to list, pause, resume and run tasks without reloading the config
+#
+# 17/10/2026 - 1.27
+# - add calendars : one-shot tasks read from a CSV file or a SQLite table, only a window of upcoming tasks being kept in memory
+#
+# 17/10/2026 - 1.28
+# - add the slow_task, trace_size, trace_file and profile_file settings and the !schedtrace and !schedprofile commands to log slow task runs with a per command timing breakdown, keep a trace of the last runs and profile task runs with cProfile
+#
+#
+__version__ = '1.28'
 __author__    = 'Courgette'
 
-import threading, time
-import b3, b3.plugin
+import threading, time, heapq, itertools, calendar, re, datetime, Queue, bisect, os, hashlib, socket, csv, shlex
+import collections, cProfile, pstats, StringIO
+import b3, b3.plugin, b3.functions, b3.timezones
+
+try:
+    import json
+except ImportError:
+    json = None
+
+try:
+    import pytz
+except ImportError:
+    pytz = None
+
+try:
+    from b3.parsers.frostbite2 import protocol as frostbiteProtocol
+except ImportError:
+    frostbiteProtocol = None
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+
+FROSTBITE_GAMES = ('bfbc2', 'moh', 'bf3')
+MISFIRE_POLICIES = ('once', 'all', 'skip')
+
+#--------------------------------------------------------------------------------------------------
+class SchedulerPlugin(b3.plugin.Plugin):
+    ## maximum number of lines of the !schedlist and !schednext commands
+    listMax = 15
+    _tasks = None
+    _zone = None
+    _restart_tasks = None
+    _scheduler = None
+    _executor = None
+    _outbox = None
+    _pipelineFrostbite = True
+    _statsDump = None
+    _adminPlugin = None
+    _jitter = 0
+    _journal = None
+    _misfire = 'once'
+    _gameState = None
+    _cvarCache = None
+    _eventTasks = None
+    _listenedEvents = None
+    _link = None
+    _deferredRuns = None
+    _commands = None
+    _targetPlugins = None
+    _fleet = None
+    _lease = None
+    _paused = None
+    _tasksByName = None
+    _calendars = ()
+    _tracer = None
+    _traceFile = None
+    
+    def onLoadConfig(self):
+
+        if self._executor is None:
+            self._executor = self._createExecutor()
+            if self.console.gameName not in FROSTBITE_GAMES:
+                self._outbox = self._createOutbox()
+            self._journal = self._createJournal()
+            self._lease = self._createLease()
+        if self._scheduler is None:
+            self._scheduler = TaskScheduler(self, self._executor)
+        if self._restart_tasks is None:
+            self._restart_tasks = set()
+        if self._paused is None:
+            self._paused = set()
+        if self._gameState is None:
+            self._gameState = GameState(self.console)
+        if self._cvarCache is None:
+            self._cvarCache = CvarCache()
+        if self._link is None:
+            self._link = ServerLink(self)
+            self._deferredRuns = {}
+        self._loadServerLink()
+        self._loadFleet()
+        try:
+            self._gameState.ttl = self.config.getfloat('settings', 'state_ttl')
+        except Exception:
+            self._gameState.ttl = GameState.defaultTtl
+
+        previousZone = self._zone
+        self._loadTimezone()
+
+        previousJitter = self._jitter
+        try:
+            self._jitter = int(b3.functions.time2minutes(self.config.get('settings', 'jitter')) * 60)
+        except Exception:
+            self._jitter = 0
+
+        try:
+            self._misfire = self.config.get('settings', 'misfire').strip().lower()
+        except Exception:
+            self._misfire = 'once'
+        if self._misfire not in MISFIRE_POLICIES:
+            self.error("misfire must be one of %s, using once" % ', '.join(MISFIRE_POLICIES))
+            self._misfire = 'once'
+
+        try:
+            self._pipelineFrostbite = self.config.getboolean('settings', 'frostbite_pipelining')
+        except Exception:
+            self._pipelineFrostbite = True
+
+        self._commands = {}
+        # only share the expressions of the tasks of this config
+        CronExpression._compiled.clear()
+        self._targetPlugins = {}
+
+        # index existing tasks by fingerprint so unchanged tasks are kept as is
+        previous = {}
+        for t in self._tasks or []:
+            previous.setdefault(t.fingerprint, []).append(t)
+
+        # load tasks from config
+        self._tasks = []
+        kept = []
+        for tag, taskClass in (('restart', RestartTask), ('cron', CronTask), ('hourly', HourlyTask), ('daily', DaylyTask),
+                ('on_event', EventTask)):
+            for taskconfig in self.config.get(tag):
+                fingerprint = taskFingerprint(taskconfig)
+                if previous.get(fingerprint):
+                    task = previous[fingerprint].pop(0)
+                    self._tasks.append(task)
+                    kept.append(task)
+                    self.debug("%s task [%s] unchanged" % (tag, task.name))
+                    continue
+                try:
+                    task = taskClass(self, taskconfig)
+                    task.fingerprint = fingerprint
+                    self._tasks.append(task)
+                    self.info("%s task [%s] loaded" % (tag, task.name))
+                except Exception, e:
+                    self.error(e)
+
+        # remove tasks which are no longer in the config or were modified
+        removed = 0
+        for tasks in previous.values():
+            for t in tasks:
+                t.cancel()
+                run = self._deferredRuns.pop(t, None)
+                if run is not None:
+                    self._scheduler.remove(run)
+                self._paused.discard(t)
+                removed += 1
+
+        # kept tasks have to follow a timezone or jitter change
+        if (previousZone and previousZone.name != self._zone.name) or previousJitter != self._jitter:
+            for t in kept:
+                if isinstance(t, CronTask) and t not in self._paused:
+                    self._scheduler.remove(t)
+                    t.schedule()
+
+        self.debug("%d tasks scheduled (%d unchanged, %d added, %d removed)" % (len(self._tasks), len(kept),
+            len(self._tasks) - len(kept), removed))
+
+        self._tasksByName = {}
+        for t in self._tasks:
+            self._tasksByName.setdefault(("%s" % t.name).lower(), []).append(t)
+
+        # index event tasks by event type and only listen to the events they need
+        self._eventTasks = {}
+        for t in self._tasks:
+            if isinstance(t, EventTask):
+                for eventId in t.eventIds:
+                    self._eventTasks.setdefault(eventId, []).append(t)
+        for eventId in self._eventTasks:
+            self._listen(eventId)
+
+        self._loadCalendars()
+        self._loadStatsDump()
+        self._loadTracer()
+
+    def onStartup(self):
+        self._adminPlugin = self.console.getPlugin('admin')
+        if self._adminPlugin:
+            self._registerCommands()
+        else:
+            self.warning("could not find admin plugin, commands are not available")
+
+        self._checkTargetPlugins()
+        self._listen(self.console.getEventID('EVT_STOP'))
+        self._listen(self.console.getEventID('EVT_GAME_MAP_CHANGE'))
+        self._listen(self.console.getEventID('EVT_GAME_EXIT'))
+        if self._lease is not None:
+            self._lease.renew()
+            self._lease.start()
+        self._executor.start()
+        self._scheduler.start()
+        if self._outbox is not None:
+            self._outbox.start()
+        if self._journal is not None:
+            self._journal.start()
+            # missed runs are looked for by the scheduler thread, not to delay
+            # B3 startup
+            self._scheduler.addAt(MisfireCheck(self, self._scheduler.clock()), self._scheduler.clock())
+
+        # run RestartTasks
+        for task in self._restart_tasks:
+            task.trigger()
+
+ 
+    def onEvent(self, event):
+        if event.type == self.console.getEventID('EVT_GAME_MAP_CHANGE'):
+            self._gameState.invalidate()
+            self._cvarCache.clear()
+        elif event.type == self.console.getEventID('EVT_GAME_EXIT'):
+            self._cvarCache.clear()
+        elif event.type == self.console.getEventID('EVT_STOP'):
+            self._scheduler.stop()
+            self._deferredRuns.clear()
+            self._executor.stop()
+            if self._outbox is not None:
+                self._outbox.stop()
+            if self._journal is not None:
+                self._journal.stop()
+            self._fleet.stop()
+            if self._lease is not None:
+                self._lease.stop()
+
+        for task in self._eventTasks.get(event.type, ()):
+            if task not in self._paused:
+                task.trigger(event)
+
+    def _listen(self, eventId):
+        """
+        register an event once
+        """
+        if self._listenedEvents is None:
+            self._listenedEvents = set()
+        if eventId not in self._listenedEvents:
+            self._listenedEvents.add(eventId)
+            self.registerEvent(eventId)
+        
+    def _createExecutor(self):
+        """
+        the number of worker threads and the maximum number of task runs
+        waiting for a worker are read from the settings. Changing them
+        requires a B3 restart
+        """
+        try:
+            workers = self.config.getint('settings', 'workers')
+        except Exception:
+            workers = TaskExecutor.defaultWorkers
+        try:
+            maxQueued = self.config.getint('settings', 'max_queued_runs')
+        except Exception:
+            maxQueued = TaskExecutor.defaultMaxQueued
+        self.debug("task executor : %s workers, %s queued runs max" % (workers, maxQueued))
+        return TaskExecutor(self, workers, maxQueued)
+
+    def _createOutbox(self):
+        """
+        rcon commands go through an outbound queue when batching or rate
+        limiting is enabled in the settings. Changing them requires a B3 restart
+        """
+        try:
+            batch = self.config.getboolean('settings', 'rcon_batch')
+        except Exception:
+            batch = False
+        try:
+            rate = self.config.getfloat('settings', 'rcon_rate')
+        except Exception:
+            rate = 0
+        try:
+            burst = self.config.getint('settings', 'rcon_burst')
+        except Exception:
+            burst = 1
+        if not batch and rate <= 0:
+            return None
+        self.debug("rcon outbox : batching %s, %s commands/s max, bursts of %s" % (batch and 'on' or 'off', rate or 'no', burst))
+        return RconOutbox(self, self.console, batch, rate, burst)
+
+    def _loadServerLink(self):
+        """
+        commands sent to the game server time out after command_timeout
+        seconds and are retried command_retries times, waiting command_backoff
+        seconds then twice as long each time. After circuit_threshold failed
+        commands in a row, the game server is considered unreachable and tasks
+        are deferred for circuit_reset seconds
+        """
+        link = self._link
+        for name, attr, getter, default in (('command_timeout', 'timeout', self.config.getfloat, ServerLink.defaultTimeout),
+                ('command_retries', 'retries', self.config.getint, ServerLink.defaultRetries),
+                ('command_backoff', 'backoff', self.config.getfloat, ServerLink.defaultBackoff),
+                ('circuit_threshold', 'threshold', self.config.getint, CircuitBreaker.defaultThreshold),
+                ('circuit_reset', 'resetTimeout', self.config.getfloat, CircuitBreaker.defaultResetTimeout)):
+            try:
+                value = getter('settings', name)
+            except Exception:
+                value = default
+            if attr in ('threshold', 'resetTimeout'):
+                setattr(link.breaker, attr, value)
+            else:
+                setattr(link, attr, value)
+
+    def _loadFleet(self):
+        """
+        remote game servers tasks can be sent to are declared with <server>
+        elements. At most fleet_connections connections to them are open at
+        once
+        """
+        if self._fleet is None:
+            self._fleet = Fleet(self)
+        try:
+            self._fleet.pool.size = max(self.config.getint('settings', 'fleet_connections'), 1)
+        except Exception:
+            self._fleet.pool.size = ConnectionPool.defaultSize
+        self._fleet.load(self.config.get('server'))
+        if self._fleet.servers:
+            self.debug("fleet : %s servers, %s groups, %s connections max" % (len(self._fleet.servers),
+                len(self._fleet.groups), self._fleet.pool.size))
+
+    def sharedCommand(self, cmd):
+        """
+        return the already compiled command identical to cmd, or cmd
+        """
+        return self._commands.setdefault(cmd.key(), cmd)
+
+    def targetPlugin(self, name):
+        """
+        return the B3 plugin an enable_plugin or disable_plugin command acts on
+        """
+        try:
+            return self._targetPlugins[name]
+        except KeyError:
+            target = self.console.getPlugin(name)
+            if not target:
+                raise TaskConfigError('cannot find plugin %s' % name)
+            self._targetPlugins[name] = target
+            return target
+
+    def _checkTargetPlugins(self):
+        """
+        report the plugins enable_plugin and disable_plugin commands refer to
+        which are not loaded, once all plugins are
+        """
+        names = {}
+        for task in self._tasks or []:
+            for cmd in task.commands:
+                if isinstance(cmd, (EnablePluginCommand, DisablePluginCommand)):
+                    names.setdefault(cmd.pluginName, task.name)
+        for name, taskName in sorted(names.items()):
+            try:
+                self.targetPlugin(name)
+            except TaskConfigError, e:
+                self.error("task %s : %s" % (taskName, e))
+
+    def deferTask(self, task, commands=None):
+        """
+        run task, or only the given commands of task, again once the game
+        server may be reachable again
+        """
+        run = self._deferredRuns.get(task)
+        if run is not None:
+            # a single deferred run per task, sending all the deferred commands
+            if commands is None or run.commands is None:
+                run.commands = None
+            else:
+                run.commands = run.commands + [x for x in commands if x not in run.commands]
+            return
+        run = DeferredRun(task, commands)
+        self._deferredRuns[task] = run
+        self._scheduler.addAt(run, self._link.breaker.retryAt())
+
+    def runDropped(self, task):
+        """
+        a due run of task was dropped without running (plugin disabled, too
+        many runs waiting for a worker)
+        """
+        if isinstance(task, DeferredRun) and self._deferredRuns.get(task.task) is task:
+            # let the next deferral schedule a new run
+            del self._deferredRuns[task.task]
+        elif isinstance(task, Calendar) and not task.exhausted and self._scheduler.scheduledAt(task) is None:
+            # the calendar would never load its next events
+            self._scheduler.addAt(task, self._scheduler.clock() + Calendar.retryDelay)
+
+    def _createJournal(self):
+        """
+        the last run of each task is journaled to the journal_file from the
+        settings, if set. Changing it requires a B3 restart
+        """
+        try:
+            path = self.config.get('settings', 'journal_file').strip()
+        except Exception:
+            return None
+        if not path:
+            return None
+        journal = RunJournal(self, b3.getAbsolutePath(path))
+        journal.load()
+        self.debug("task runs journaled to %s (%s tasks known)" % (journal.path, len(journal.entries)))
+        return journal
+
+    def _createLease(self):
+        """
+        with a lease_file in the settings, only the B3 instance holding the
+        lease stored in that file (or SQLite database, see lease_backend) runs
+        tasks. Changing it requires a B3 restart
+        """
+        try:
+            path = self.config.get('settings', 'lease_file').strip()
+        except Exception:
+            return None
+        if not path:
+            return None
+        try:
+            backend = self.config.get('settings', 'lease_backend').strip().lower()
+        except Exception:
+            backend = 'file'
+        try:
+            ttl = max(self.config.getfloat('settings', 'lease_ttl'), 1)
+        except Exception:
+            ttl = Lease.defaultTtl
+        path = b3.getAbsolutePath(path)
+        try:
+            if backend == 'sqlite':
+                store = SqliteLeaseStore(path, 'scheduler %s' % self.serverKey())
+            elif backend == 'file':
+                store = FileLeaseStore(path)
+            else:
+                raise TaskConfigError("lease_backend must be file or sqlite")
+        except Exception, e:
+            self.error("%s, tasks run without lease" % e)
+            return None
+        lease = Lease(self, store, ttl)
+        self.debug("tasks run only while holding the lease in %s (%s, %ss)" % (path, backend, ttl))
+        return lease
+
+    def isLeader(self):
+        """
+        tell if this B3 instance is the one running the tasks
+        """
+        return self._lease is None or self._lease.held()
+
+    def _catchUp(self, now=None):
+        """
+        apply the misfire policy of the tasks which missed runs since their
+        last journaled run
+        """
+        if now is None:
+            now = self._scheduler.clock()
+        for task in self._tasks or []:
+            if not isinstance(task, CronTask):
+                continue
+            last = self._journal.last(task.journalKey())
+            if last is None:
+                continue
+            policy = task.misfire or self._misfire
+            if policy == 'skip':
+                continue
+            missed = task.lastFireTimes(last, now, policy == 'once' and 1 or CatchUpRun.maxRuns)
+            if not missed:
+                continue
+            self.info("task %s missed runs since %s, catching up %s of them" % (task.name,
+                time.strftime('%Y-%m-%d %H:%M:%S', self._zone.localtime(last)), len(missed)))
+            self._executor.submit(CatchUpRun(task, missed), missed[-1])
+
+    def gameState(self):
+        return self._gameState
+
+    def taskRan(self, task, when):
+        """
+        called by the executor once all the commands of a run of task
+        scheduled at when were sent successfully
+        """
+        if self._journal is None:
+            return
+        if isinstance(task, CronTask) or (isinstance(task, CatchUpRun) and isinstance(task.task, CronTask)):
+            self._journal.record(task.journalKey(), when)
+
+    def serverKey(self):
+        """
+        identify the game server this B3 instance is managing
+        """
+        return '%s:%s' % (getattr(self.console, '_publicIp', ''), getattr(self.console, '_port', ''))
+
+    def _loadCalendars(self):
+        """
+        calendars are read again from their file on each config load
+        """
+        for c in self._calendars:
+            c.cancel()
+        self._calendars = []
+        for node in self.config.get('calendar'):
+            try:
+                c = Calendar.fromConfig(self, node)
+                c.start()
+            except Exception, e:
+                self.error("calendar %s : %s" % (node.attrib.get('name'), e))
+                continue
+            self._calendars.append(c)
+            self.info("calendar [%s] loaded" % c.name)
+
+    def _loadStatsDump(self):
+        """
+        task metrics are written to the stats_file every stats_interval
+        seconds when stats_file is set
+        """
+        if self._statsDump is not None:
+            self._scheduler.remove(self._statsDump)
+            self._statsDump = None
+        try:
+            path = self.config.get('settings', 'stats_file')
+        except Exception:
+            return
+        if not path.strip():
+            return
+        if json is None:
+            self.error("stats_file requires the json python module")
+            return
+        try:
+            interval = self.config.getint('settings', 'stats_interval')
+        except Exception:
+            interval = 60
+        self._statsDump = StatsDump(self, b3.getAbsolutePath(path.strip()), max(interval, 1))
+        self._scheduler.add(self._statsDump)
+        self.debug("task metrics written to %s every %ss" % (self._statsDump.path, self._statsDump.interval))
+
+    def _loadTracer(self):
+        """
+        task runs are traced only when trace_size or slow_task is set, or
+        while the !schedprofile command is capturing runs
+        """
+        try:
+            size = max(self.config.getint('settings', 'trace_size'), 0)
+        except Exception:
+            size = 0
+        try:
+            slow = max(self.config.getfloat('settings', 'slow_task'), 0)
+        except Exception:
+            slow = 0
+        self._traceFile = None
+        profilePath = None
+        for name in ('trace_file', 'profile_file'):
+            try:
+                path = self.config.get('settings', name).strip()
+            except Exception:
+                continue
+            if path:
+                if name == 'trace_file':
+                    self._traceFile = b3.getAbsolutePath(path)
+                else:
+                    profilePath = b3.getAbsolutePath(path)
+        if not size and not slow and not (self._tracer and self._tracer._profileLeft):
+            self._tracer = None
+            return
+        if self._tracer is None or self._tracer.size != size:
+            previous = self._tracer
+            self._tracer = TaskTracer(self, size, slow, profilePath)
+            if previous is not None:
+                self._tracer.records.extend(previous.records)
+                self._tracer.profile(previous._profileLeft)
+        self._tracer.slow = slow
+        self._tracer.profilePath = profilePath
+        self.debug("task runs traced : last %s runs kept, slow above %ss" % (size, slow or 'never'))
+
+    def _registerCommands(self):
+        if 'commands' in self.config.sections():
+            for cmd in self.config.options('commands'):
+                level = self.config.get('commands', cmd)
+                sp = cmd.split('-')
+                alias = None
+                if len(sp) == 2:
+                    cmd, alias = sp
+                func = self._getCmd(cmd)
+                if func:
+                    self._adminPlugin.registerCommand(self, cmd, level, func, alias)
+
+    def _getCmd(self, cmd):
+        cmd = 'cmd_%s' % cmd
+        if hasattr(self, cmd):
+            return getattr(self, cmd)
+        return None
+
+    def cmd_schedstats(self, data, client, cmd=None):
+        """\
+        [<task>] - show run metrics of scheduled tasks
+        """
+        tasks = self._tasks or []
+        if data:
+            tasks = [t for t in tasks if data.strip().lower() in t.name.lower()]
+            if not tasks:
+                client.message('^7no task matching ^3%s' % data)
+                return
+            for t in tasks:
+                s = t.stats
+                client.message('^3%s^7 : %s runs, %s skipped, %s deferred, %s dropped' % (t.name, s.runs,
+                    s.skipped, s.deferred, s.dropped))
+                client.message('^7late p50 %.3fs p95 %.3fs max %.3fs' % (s.lateness.percentile(50),
+                    s.lateness.percentile(95), s.lateness.max))
+                client.message('^7commands %s ok %s failed, p50 %.3fs p95 %.3fs max %.3fs' % (s.commands_ok,
+                    s.commands_failed, s.latency.percentile(50), s.latency.percentile(95), s.latency.max))
+            return
+        client.message('^7%s tasks, %s runs waiting for a worker' % (len(tasks), self._executor.queueDepth()))
+        for t in tasks:
+            s = t.stats
+            client.message('^3%s^7 : %s runs, %s failed, late p95 %.3fs' % (t.name, s.runs, s.commands_failed,
+                s.lateness.percentile(95)))
+
+    def cmd_schedfleet(self, data, client, cmd=None):
+        """\
+        [<server>] - show command results of the fleet servers
+        """
+        servers = sorted(self._fleet.servers.values(), key=lambda x: x.name)
+        if data:
+            servers = [x for x in servers if data.strip().lower() in x.name.lower()]
+        if not servers:
+            client.message('^7no server found')
+            return
+        for server in servers:
+            s = server.stats
+            state = server.link.breaker.isOpen() and '^1unreachable' or '^2ok'
+            client.message('^3%s^7 : %s^7, %s ok %s failed, p95 %.3fs' % (server.name, state, s.commands_ok,
+                s.commands_failed, s.latency.percentile(95)))
+            if data and server.lastError:
+                client.message('^7last error : %s' % server.lastError)
+
+    def pauseTask(self, task):
+        """
+        stop scheduling task until resumeTask is called. Its pending delayed,
+        debounced or deferred runs are cancelled
+        """
+        if task in self._paused:
+            return False
+        self._paused.add(task)
+        self._scheduler.remove(task)
+        run = self._deferredRuns.pop(task, None)
+        if run is not None:
+            self._scheduler.remove(run)
+        return True
+
+    def resumeTask(self, task):
+        if task not in self._paused:
+            return False
+        self._paused.discard(task)
+        if isinstance(task, CronTask):
+            self._scheduler.add(task)
+        return True
+
+    def _findTasks(self, data, client):
+        """
+        return the tasks named data or, if none, the tasks whose name contains
+        data. Tell client when there is none
+        """
+        name = data.strip().lower()
+        tasks = self._tasksByName.get(name)
+        if not tasks:
+            tasks = [t for t in self._tasks or [] if name in ("%s" % t.name).lower()]
+        if not tasks:
+            client.message('^7no task matching ^3%s' % data)
+        return tasks
+
+    def _formatTime(self, when):
+        if when is None:
+            return 'not scheduled'
+        return time.strftime('%Y-%m-%d %H:%M:%S', self._zone.localtime(when))
+
+    def cmd_schedlist(self, data, client, cmd=None):
+        """\
+        [<task>] - list scheduled tasks and when they run next
+        """
+        tasks = self._tasks or []
+        if data:
+            tasks = self._findTasks(data, client)
+        for t in tasks[:self.listMax]:
+            if t in self._paused:
+                state = '^1paused'
+            elif isinstance(t, EventTask):
+                state = '^7on event'
+            elif isinstance(t, RestartTask):
+                state = '^7on restart'
+            else:
+                state = '^7next %s' % self._formatTime(self._scheduler.scheduledAt(t))
+            client.message('^3%s^7 (%s) : %s' % (t.name, t.__class__.__name__, state))
+        if len(tasks) > self.listMax:
+            client.message('^7and %s more tasks' % (len(tasks) - self.listMax))
+
+    def cmd_schedpause(self, data, client, cmd=None):
+        """\
+        <task> - stop running a task until it is resumed
+        """
+        if not data:
+            client.message('^7usage: !schedpause <task>')
+            return
+        for t in self._findTasks(data, client):
+            if self.pauseTask(t):
+                self.info("task %s paused by %s" % (t.name, client.name))
+                client.message('^7task ^3%s^7 paused' % t.name)
+            else:
+                client.message('^7task ^3%s^7 is already paused' % t.name)
+
+    def cmd_schedresume(self, data, client, cmd=None):
+        """\
+        <task> - run a paused task again on schedule
+        """
+        if not data:
+            client.message('^7usage: !schedresume <task>')
+            return
+        for t in self._findTasks(data, client):
+            if self.resumeTask(t):
+                self.info("task %s resumed by %s" % (t.name, client.name))
+                client.message('^7task ^3%s^7 resumed' % t.name)
+            else:
+                client.message('^7task ^3%s^7 is not paused' % t.name)
+
+    def cmd_schedrun(self, data, client, cmd=None):
+        """\
+        <task> - run a task now
+        """
+        if not data:
+            client.message('^7usage: !schedrun <task>')
+            return
+        tasks = self._findTasks(data, client)
+        if len(tasks) > 1:
+            client.message('^7%s tasks match ^3%s^7, be more specific' % (len(tasks), data))
+            return
+        for t in tasks:
+            self.info("task %s run by %s" % (t.name, client.name))
+            if self._executor.submit(t):
+                client.message('^7task ^3%s^7 started' % t.name)
+            else:
+                client.message('^7task ^3%s^7 could not be started' % t.name)
+
+    def cmd_schednext(self, data, client, cmd=None):
+        """\
+        [<n>] - show the next n task runs
+        """
+        try:
+            count = min(max(int(data or 5), 1), self.listMax)
+        except ValueError:
+            client.message('^7usage: !schednext [<n>]')
+            return
+        runs = self._scheduler.upcoming(count, lambda task: isinstance(task, Task))
+        if not runs:
+            client.message('^7no task scheduled')
+        for when, task in runs:
+            client.message('^7%s : ^3%s' % (self._formatTime(when), task.name))
+
+    def cmd_schedtrace(self, data, client, cmd=None):
+        """\
+        [<n>] - show the n slowest traced task runs and export the trace
+        """
+        if self._tracer is None or not self._tracer.size:
+            client.message('^7tracing is disabled, set trace_size in the scheduler config')
+            return
+        try:
+            count = min(max(int(data or 5), 1), self.listMax)
+        except ValueError:
+            client.message('^7usage: !schedtrace [<n>]')
+            return
+        for record in self._tracer.slowest(count):
+            client.message('^3%s^7 : %.3fs, late %.3fs' % (record['task'], record['duration'], record['lateness']))
+        if self._traceFile and json is not None:
+            try:
+                self._tracer.export(self._traceFile)
+                client.message('^7trace of %s runs written to %s' % (len(self._tracer.records), self._traceFile))
+            except (IOError, OSError), e:
+                client.message('^7could not write trace : %s' % e)
+
+    def cmd_schedprofile(self, data, client, cmd=None):
+        """\
+        <n> - profile the next n task runs
+        """
+        try:
+            count = int(data)
+            if count < 1:
+                raise ValueError
+        except ValueError:
+            client.message('^7usage: !schedprofile <n>')
+            return
+        if self._tracer is None:
+            self._tracer = TaskTracer(self)
+            self._tracer.profile(count)
+            self._loadTracer()
+        else:
+            self._tracer.profile(count)
+        client.message('^7profiling the next %s task runs' % count)
+
+    def _loadTimezone(self):
+        """
+        schedules are evaluated in the timezone from the plugin settings or, if
+        not set, in the time_zone from the main B3 config
+        """
+        try:
+            tzName = self.config.get('settings', 'timezone')
+        except Exception:
+            tzName = self._defaultTimezone()
+        if self._zone and self._zone.name.lower() == ("%s" % tzName).strip().lower():
+            return
+        try:
+            self._zone = getTimezone(tzName)
+        except ValueError, e:
+            self.error("%s, using system local time instead" % e)
+            self._zone = getTimezone('local')
+        if self._zone.fixed and self._zone is not UTC:
+            self.warning("timezone %s has a fixed UTC offset and does not follow daylight saving time. "
+                "Set the 'timezone' setting to 'local' or to a tz database name (requires pytz)" % self._zone.name)
+        self.info("schedules are evaluated in timezone %s" % self._zone.name)
+
+    def _defaultTimezone(self):
+        """
+        the time_zone of the main B3 config is an abbreviation with a fixed UTC
+        offset. When it is the standard or daylight saving time abbreviation of
+        the system timezone, the system timezone is used instead so schedules
+        follow its daylight saving time changes
+        """
+        try:
+            tzName = ("%s" % self.console.config.get('b3', 'time_zone')).strip()
+        except Exception:
+            return 'local'
+        if tzName.upper() in [x.upper() for x in time.tzname]:
+            return 'local'
+        return tzName
+ 
+ 
+#--------------------------------------------------------------------------------------------------
+class TaskScheduler(object):
+    """
+    Keep scheduled tasks in a heap ordered by their next fire time and run
+    them from a single thread which sleeps until the earliest deadline.
+    Delayed one-shot runs (see addAt) go through the same heap and thread.
+
+    Each heap entry is a list [when, sequence, task]. Removing a task only
+    clears its entry, which is then discarded when it reaches the top of the
+    heap.
+    """
+    ## the thread wakes up at least that often to notice system clock changes
+    maxWait = 60
+    ## a task fired later than that is rescheduled from the current time
+    ## instead of from its missed occurrence (system clock changed)
+    maxLateness = 120
+
+    def __init__(self, plugin, executor, clock=time.time):
+        self.plugin = plugin
+        self.executor = executor
+        self.clock = clock
+        self._heap = []
+        self._entries = {}
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._running = False
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, task, now=None):
+        """
+        schedule task at its next occurrence after now
+        """
+        if now is None:
+            now = self.clock()
+        self._condition.acquire()
+        try:
+            self._push(task, task.next_fire(now))
+            self._condition.notify()
+        finally:
+            self._condition.release()
+
+    def addAt(self, task, when):
+        """
+        schedule a single run of task at timestamp when
+        """
+        self._condition.acquire()
+        try:
+            self._push(task, when)
+            self._condition.notify()
+        finally:
+            self._condition.release()
+
+    def remove(self, task):
+        """
+        remove task from the schedule
+        """
+        self._condition.acquire()
+        try:
+            entry = self._entries.pop(task, None)
+            if entry:
+                entry[-1] = None
+        finally:
+            self._condition.release()
+
+    def scheduledAt(self, task):
+        """
+        return the timestamp task is scheduled at or None
+        """
+        entry = self._entries.get(task)
+        return entry and entry[0]
+
+    def upcoming(self, count, accept=None):
+        """
+        return the next count (when, task) scheduled, earliest first, for the
+        tasks accept returns True for. The heap is walked from its root and
+        only the children of the entries found so far are looked at
+        """
+        found = []
+        self._condition.acquire()
+        try:
+            heap = self._heap
+            frontier = heap and [(heap[0][0], heap[0][1], 0)] or []
+            while frontier and len(found) < count:
+                when, seq, i = heapq.heappop(frontier)
+                task = heap[i][-1]
+                if task is not None and self._entries.get(task) is heap[i] and (accept is None or accept(task)):
+                    found.append((when, task))
+                for child in (2 * i + 1, 2 * i + 2):
+                    if child < len(heap):
+                        heapq.heappush(frontier, (heap[child][0], heap[child][1], child))
+        finally:
+            self._condition.release()
+        return found
+
+    def nextDeadline(self):
+        """
+        return the timestamp of the earliest scheduled occurrence or None
+        """
+        self._condition.acquire()
+        try:
+            return self._peek()
+        finally:
+            self._condition.release()
+
+    def runPending(self, now=None):
+        """
+        hand all the tasks due at now to the executor and reschedule them.
+        Return the list of tasks that were due
+        """
+        if now is None:
+            now = self.clock()
+        due = []
+        tracer = self.plugin._tracer
+        if tracer is not None:
+            start = time.time()
+        self._condition.acquire()
+        try:
+            while self._peek() is not None and self._heap[0][0] <= now:
+                when, seq, task = heapq.heappop(self._heap)
+                due.append((task, when))
+                if now - when > self.maxLateness:
+                    when = now
+                # one-shot runs have no next occurrence and are dropped here
+                self._push(task, task.next_fire(when))
+        finally:
+            self._condition.release()
+        if tracer is not None:
+            tracer.tick(time.time() - start, len(due))
+
+        for task, when in due:
+            if not self.plugin.isEnabled():
+                self.plugin.runDropped(task)
+            elif not self.executor.submit(task, when):
+                self.plugin.runDropped(task)
+        return [task for task, when in due]
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        thread = threading.Thread(target=self._run, name="scheduler")
+        thread.setDaemon(True)
+        thread.start()
+
+    def stop(self):
+        """
+        stop the scheduler thread, pending runs are cancelled
+        """
+        self._condition.acquire()
+        try:
+            self._running = False
+            self._heap = []
+            self._entries.clear()
+            self._condition.notify()
+        finally:
+            self._condition.release()
+
+    def _push(self, task, when):
+        if when is None:
+            self._entries.pop(task, None)
+            return
+        entry = [when, self._sequence.next(), task]
+        self._entries[task] = entry
+        heapq.heappush(self._heap, entry)
+
+    def _peek(self):
+        while self._heap and self._heap[0][-1] is None:
+            heapq.heappop(self._heap)
+        if self._heap:
+            return self._heap[0][0]
+        return None
+
+    def _run(self):
+        self.plugin.debug("scheduler thread started")
+        while True:
+            self._condition.acquire()
+            try:
+                if not self._running:
+                    break
+                deadline = self._peek()
+                now = self.clock()
+                if deadline is None or deadline > now:
+                    wait = self.maxWait
+                    if deadline is not None:
+                        wait = min(wait, deadline - now)
+                    self._condition.wait(wait)
+                    continue
+            finally:
+                self._condition.release()
+            self.runPending(now)
+        self.plugin.debug("scheduler thread stopped")
+
+
+#--------------------------------------------------------------------------------------------------
+class TaskExecutor(object):
+    """
+    Run tasks on a bounded pool of worker threads so that slow game servers
+    never hold the scheduler thread.
+
+    When a task is due while its previous run has not finished, its overlap
+    policy decides what happens :
+      skip       : the new run is dropped
+      queue      : the new run starts when the previous one is done (at most
+                   one run is kept waiting)
+      concurrent : the new run is executed anyway
+    With 0 workers, tasks run synchronously in the submitting thread.
+    """
+    defaultWorkers = 4
+    defaultMaxQueued = 100
+
+    def __init__(self, plugin, workers=defaultWorkers, maxQueued=defaultMaxQueued, clock=time.time):
+        self.plugin = plugin
+        self.workers = workers
+        self.clock = clock
+        self._queue = Queue.Queue(maxQueued)
+        self._lock = threading.Lock()
+        self._active = {}
+        self._deferred = {}
+        self._threads = []
+
+    def queueDepth(self):
+        """
+        return the number of task runs waiting for a worker
+        """
+        return self._queue.qsize()
+
+    def submit(self, task, when=None):
+        """
+        run task on a worker thread, according to its overlap policy. when is
+        the time the run was scheduled at. Return False if the run was skipped
+        or could not be queued
+        """
+        if when is None:
+            when = self.clock()
+        self._lock.acquire()
+        try:
+            if self._active.get(task):
+                if task.overlap == 'queue':
+                    self.plugin.debug("task %s is still running, its next run will wait" % task.name)
+                    self._deferred.setdefault(task, when)
+                    task.stats.incr('deferred')
+                    return True
+                elif task.overlap != 'concurrent':
+                    self.plugin.info("task %s is still running, skipping this run" % task.name)
+                    task.stats.incr('skipped')
+                    return False
+                task.stats.incr('overlapped')
+            self._active[task] = self._active.get(task, 0) + 1
+        finally:
+            self._lock.release()
+
+        if not self.workers:
+            self._run(task, when)
+            return True
+        try:
+            self._queue.put_nowait((task, when))
+        except Queue.Full:
+            self.plugin.error("too many task runs waiting for a worker, dropping run of task %s" % task.name)
+            task.stats.incr('dropped')
+            self._done(task)
+            return False
+        depth = self._queue.qsize()
+        if depth > self.workers:
+            self.plugin.warning("%s task runs waiting for a worker" % depth)
+        return True
+
+    def start(self):
+        if self._threads or not self.workers:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name="scheduler-worker-%s" % i)
+            thread.setDaemon(True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        for thread in self._threads:
+            self._queue.put(None)
+        self._threads = []
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            self._run(*item)
+
+    def _run(self, task, when):
+        now = self.clock()
+        task.stats.runStarted(now, now - when)
+        tracer = self.plugin._tracer
+        outbox = self.plugin._outbox
+        if outbox is not None:
+            outbox.runStarted(task, when)
+        ran = False
+        try:
+            try:
+                if tracer is None:
+                    ran = task.runcommands()
+                else:
+                    ran = tracer.run(task, when, now, task.runcommands)
+            except Exception, e:
+                self.plugin.error("could not run task %s : %s" % (task.name, e))
+        finally:
+            if outbox is not None:
+                # runs with commands still queued are reported by the outbox
+                ran = outbox.runFinished(ran)
+        if ran:
+            self.plugin.taskRan(task, when)
+        self._done(task)
+
+    def _done(self, task):
+        self._lock.acquire()
+        try:
+            self._active[task] -= 1
+            if self._active[task]:
+                return
+            del self._active[task]
+            if task not in self._deferred:
+                return
+            when = self._deferred.pop(task)
+        finally:
+            self._lock.release()
+        self.submit(task, when)
+
+
+#--------------------------------------------------------------------------------------------------
+def atomic_write(path, data):
+    """
+    replace the content of the file at path with data, so readers never see
+    a partly written file
+    """
+    tmp = path + '.tmp'
+    f = open(tmp, 'w')
+    try:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    finally:
+        f.close()
+    try:
+        os.rename(tmp, path)
+    except OSError:
+        # windows does not replace existing files
+        os.remove(path)
+        os.rename(tmp, path)
+
+
+class TaskTracer(object):
+    """
+    Opt-in instrumentation of task runs. The executor and the scheduler only
+    go through it when it is enabled. A traced run records how late it
+    started and the time spent checking its conditions and running each of
+    its commands. Runs slower than slow seconds are logged with that
+    breakdown, the last size runs are kept in a ring buffer which can be
+    exported as JSON, and the next runs can be captured with cProfile
+    """
+
+    def __init__(self, plugin, size=0, slow=0, profilePath=None):
+        self.plugin = plugin
+        self.size = size
+        self.slow = slow
+        self.profilePath = profilePath
+        self.records = collections.deque(maxlen=max(size, 1))
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._profileLeft = 0
+        self._profileStats = None
+
+    def run(self, task, when, now, func):
+        record = {'task': task.name, 'type': task.__class__.__name__, 'scheduled': when, 'lateness': now - when,
+            'phases': []}
+        self._local.record = record
+        start = time.time()
+        try:
+            if self._profileLeft > 0:
+                return self._profile(func)
+            return func()
+        finally:
+            self._local.record = None
+            record['duration'] = time.time() - start
+            if self.size:
+                self.records.append(record)
+            if self.slow and record['duration'] >= self.slow:
+                self.plugin.warning("slow task %s : %.3fs, started %.3fs late (%s)" % (task.name, record['duration'],
+                    record['lateness'], ', '.join(["%s %.3fs" % x for x in record['phases']])))
+
+    def phase(self, label, seconds):
+        record = getattr(self._local, 'record', None)
+        if record is not None:
+            record['phases'].append((label, seconds))
+
+    def tick(self, seconds, due):
+        if self.slow and seconds >= self.slow:
+            self.plugin.warning("slow scheduler tick : %.3fs to reschedule %s due tasks" % (seconds, due))
+
+    def slowest(self, count):
+        return sorted(list(self.records), key=lambda x: -x['duration'])[:count]
+
+    def export(self, path):
+        """
+        write the traced runs to path as JSON
+        """
+        data = {'time': time.time(), 'runs': list(self.records)}
+        atomic_write(path, json.dumps(data, indent=1, sort_keys=True))
+
+    def profile(self, count):
+        """
+        capture the next count task runs with cProfile
+        """
+        self._lock.acquire()
+        try:
+            self._profileStats = None
+            self._profileLeft = count
+        finally:
+            self._lock.release()
+
+    def _profile(self, func):
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(func)
+        finally:
+            self._collect(profiler)
+
+    def _collect(self, profiler):
+        """
+        add the statistics of a profiled run, until enough runs are captured
+        """
+        self._lock.acquire()
+        try:
+            if self._profileLeft <= 0:
+                return
+            if self._profileStats is None:
+                self._profileStats = pstats.Stats(profiler)
+            else:
+                self._profileStats.add(profiler)
+            self._profileLeft -= 1
+            if not self._profileLeft:
+                self._profileDone()
+        finally:
+            self._lock.release()
+
+    def _profileDone(self):
+        stats = self._profileStats
+        self._profileStats = None
+        if self.profilePath:
+            stats.dump_stats(self.profilePath)
+            self.plugin.info("task runs profile written to %s" % self.profilePath)
+        out = StringIO.StringIO()
+        stats.stream = out
+        stats.sort_stats('cumulative').print_stats(15)
+        self.plugin.info("task runs profile :\n%s" % out.getvalue())
+        if not self.size and not self.slow:
+            # only there for this profile
+            self.plugin._tracer = None
+
+
+class TokenBucket(object):
+    """
+    Allow rate operations per second on average, with bursts of at most burst
+    operations
+    """
+    def __init__(self, rate, burst=1, clock=time.time):
+        self.rate = float(rate)
+        self.burst = max(1, burst)
+        self.clock = clock
+        self._tokens = float(self.burst)
+        self._stamp = clock()
+
+    def take(self):
+        """
+        take a token and return how many seconds to wait before using it
+        """
+        now = self.clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+        self._tokens -= 1
+        if self._tokens >= 0:
+            return 0
+        return -self._tokens / self.rate
+
+
+class RconOutbox(object):
+    """
+    Outbound rcon command queue for one game server.
+
+    Commands sent within coalesceDelay of each other (ie: by tasks due the same
+    second) are merged into batches separated by ';' if batching is enabled.
+    Commands containing a line break or an unbalanced quote are never merged as
+    the game could split them differently. Each write to the server takes a
+    token from a token bucket so we stay under the game rcon flood limit.
+    """
+    coalesceDelay = 0.05
+    ## q3 based games truncate rcon commands at 1024 characters
+    maxBatchLength = 900
+
+    def __init__(self, plugin, console, batch=False, rate=0, burst=1, clock=time.time):
+        self.plugin = plugin
+        self.console = console
+        self.batch = batch
+        self.bucket = None
+        if rate > 0:
+            self.bucket = TokenBucket(rate, burst, clock)
+        self._pending = []
+        self._condition = threading.Condition()
+        self._stopEvent = threading.Event()
+        self._thread = None
+        self._local = threading.local()
+
+    def runStarted(self, task, when):
+        """
+        commands queued by the calling thread until runFinished belong to the
+        run of task scheduled at when
+        """
+        self._local.run = OutboxRun(self.plugin, task, when)
+
+    def runFinished(self, ok):
+        """
+        return True if the run is complete and successful. If some of its
+        commands are still queued, return False and let the outbox report the
+        run once they were written (see OutboxRun)
+        """
+        run = getattr(self._local, 'run', None)
+        self._local.run = None
+        if run is None:
+            return ok
+        return run.close(ok)
+
+    def send(self, task, command):
+        """
+        queue the rcon command of task. command.written(task) is called once
+        it was written to the game server
+        """
+        run = getattr(self._local, 'run', None)
+        if run is not None:
+            run.queued()
+        self._condition.acquire()
+        try:
+            self._pending.append((task, command, run))
+            self._condition.notify()
+        finally:
+            self._condition.release()
+
+    def start(self):
+        if self._thread:
+            return
+        self._stopEvent.clear()
+        self._thread = threading.Thread(target=self._run, name="scheduler-rcon")
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopEvent.set()
+        self._condition.acquire()
+        try:
+            self._condition.notify()
+        finally:
+            self._condition.release()
+        self._thread = None
+
+    def flush(self):
+        """
+        send all queued commands now, waiting for tokens as needed
+        """
+        self._condition.acquire()
+        try:
+            commands, self._pending = self._pending, []
+        finally:
+            self._condition.release()
+        unsent = {}
+        for entries, text in self.pack(commands):
+            tasks = [task for task, command, run in entries]
+            if self.bucket:
+                delay = self.bucket.take()
+                if delay:
+                    self._stopEvent.wait(delay)
+            start = time.time()
+            try:
+                result = self.plugin._link.call(self.console.write, text)
+                self.plugin.info("rcon command result : %s" % result)
+                ok = True
+            except CircuitOpen:
+                for task, command, run in entries:
+                    unsent.setdefault(task, []).append(command)
+                    if run is not None:
+                        run.written(False)
+                continue
+            except Exception, e:
+                self.plugin.error("task %s : %s" % (', '.join([t.name for t in tasks]), e))
+                ok = False
+                # cvars may not have been set
+                if self.plugin._cvarCache is not None:
+                    self.plugin._cvarCache.clear()
+            latency = time.time() - start
+            for task, command, run in entries:
+                task.stats.commandDone(latency, ok)
+                if ok:
+                    command.written(task)
+                if run is not None:
+                    run.written(ok)
+        for task, rest in unsent.items():
+            self.plugin.info("game server unreachable, %s commands of task %s deferred" % (len(rest), task.name))
+            task.stats.incr('deferred')
+            self.plugin.deferTask(task, rest)
+
+    def pack(self, commands):
+        """
+        return the list of (entries, text) to write for the given list of
+        queued (task, command, run) entries, entries being those merged in text
+        """
+        if not self.batch:
+            return [([entry], entry[1].text) for entry in commands]
+        batches = []
+        entries, texts, length = [], [], 0
+        for entry in commands:
+            text = entry[1].text
+            if not self.canMerge(text) or length + len(text) + 2 > self.maxBatchLength:
+                if texts:
+                    batches.append((entries, '; '.join(texts)))
+                entries, texts, length = [], [], 0
+            if not self.canMerge(text):
+                batches.append(([entry], text))
+                continue
+            entries.append(entry)
+            texts.append(text)
+            length += len(text) + 2
+        if texts:
+            batches.append((entries, '; '.join(texts)))
+        return batches
+
+    def canMerge(self, text):
+        return '\n' not in text and text.count('"') % 2 == 0 and len(text) < self.maxBatchLength
+
+    def _run(self):
+        while not self._stopEvent.isSet():
+            self._condition.acquire()
+            try:
+                if not self._pending:
+                    self._condition.wait(TaskScheduler.maxWait)
+                    continue
+            finally:
+                self._condition.release()
+            # let other tasks due the same second add their commands
+            self._stopEvent.wait(self.coalesceDelay)
+            self.flush()
+
+
+class OutboxRun(object):
+    """
+    A task run whose rcon commands went through the outbox. It is only
+    reported to the plugin (see SchedulerPlugin.taskRan) once the run is over
+    and all its queued commands were written successfully
+    """
+    def __init__(self, plugin, task, when):
+        self.plugin = plugin
+        self.task = task
+        self.when = when
+        self.pending = 0
+        self.ok = True
+        self.closed = False
+        self._lock = threading.Lock()
+
+    def queued(self):
+        self._lock.acquire()
+        try:
+            self.pending += 1
+        finally:
+            self._lock.release()
+
+    def close(self, ok):
+        """
+        the run is over. Return True if it succeeded and nothing is left to
+        write
+        """
+        self._lock.acquire()
+        try:
+            self.ok = self.ok and ok
+            self.closed = True
+            return self.ok and not self.pending
+        finally:
+            self._lock.release()
+
+    def written(self, ok):
+        """
+        one of the queued commands was written, or could not be
+        """
+        self._lock.acquire()
+        try:
+            self.ok = self.ok and ok
+            self.pending -= 1
+            report = self.closed and self.ok and not self.pending
+        finally:
+            self._lock.release()
+        if report:
+            self.plugin.taskRan(self.task, self.when)
+
+
+class Histogram(object):
+    """
+    Count durations (in seconds) in fixed log scale buckets. Percentiles are
+    approximated by the upper bound of the bucket they fall in
+    """
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    bounds = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10, 30, 60)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        value = max(value, 0)
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def mean(self):
+        if not self.count:
+            return 0.0
+        return self.total / self.count
+
+    def percentile(self, p):
+        """
+        return the upper bound of the bucket holding the p-th percentile, or
+        the max value for the overflow bucket
+        """
+        if not self.count:
+            return 0.0
+        rank = max(1, int(round(self.count * p / 100.0)))
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                if i < len(self.bounds):
+                    return min(self.bounds[i], self.max)
+                return self.max
+        return self.max
+
+    def toDict(self):
+        buckets = {}
+        for bound, n in zip(self.bounds + ('inf',), self.counts):
+            if n:
+                buckets['<=%s' % bound] = n
+        return {'count': self.count, 'mean': self.mean(), 'max': self.max,
+            'p50': self.percentile(50), 'p95': self.percentile(95), 'p99': self.percentile(99),
+            'buckets': buckets}
+
+
+class TaskStats(object):
+    """
+    Run metrics of a task : run counters, how late runs started after their
+    scheduled time and how long each command took
+    """
+    counters = ('runs', 'skipped', 'deferred', 'overlapped', 'dropped', 'guarded', 'standby', 'commands_ok',
+        'commands_failed', 'commands_unchanged')
+    __slots__ = counters + ('_lock', 'lateness', 'latency', 'lastRun')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        for name in self.counters:
+            setattr(self, name, 0)
+        self.lateness = Histogram()
+        self.latency = Histogram()
+        self.lastRun = None
+
+    def incr(self, counter):
+        self._lock.acquire()
+        try:
+            setattr(self, counter, getattr(self, counter) + 1)
+        finally:
+            self._lock.release()
+
+    def runStarted(self, now, lateness):
+        self._lock.acquire()
+        try:
+            self.runs += 1
+            self.lastRun = now
+            self.lateness.add(lateness)
+        finally:
+            self._lock.release()
+
+    def commandDone(self, latency, ok):
+        self._lock.acquire()
+        try:
+            if ok:
+                self.commands_ok += 1
+            else:
+                self.commands_failed += 1
+            self.latency.add(latency)
+        finally:
+            self._lock.release()
+
+    def toDict(self):
+        self._lock.acquire()
+        try:
+            data = dict([(name, getattr(self, name)) for name in self.counters])
+            data['last_run'] = self.lastRun
+            data['lateness'] = self.lateness.toDict()
+            data['latency'] = self.latency.toDict()
+            return data
+        finally:
+            self._lock.release()
+
+
+class MisfireCheck(object):
+    """
+    Internal one-shot job applying the misfire policy of the tasks which
+    missed runs before now (see SchedulerPlugin._catchUp)
+    """
+    name = 'misfire check'
+    overlap = 'skip'
+
+    def __init__(self, plugin, now):
+        self.plugin = plugin
+        self.now = now
+        self.stats = TaskStats()
+
+    def next_fire(self, after):
+        return None
+
+    def runcommands(self):
+        self.plugin._catchUp(self.now)
+
+
+class StatsDump(object):
+    """
+    Internal job, run by the scheduler like a task, writing the metrics of
+    all tasks to a JSON file every interval seconds
+    """
+    name = 'stats dump'
+    overlap = 'skip'
+
+    def __init__(self, plugin, path, interval):
+        self.plugin = plugin
+        self.path = path
+        self.interval = interval
+        self.stats = TaskStats()
+
+    def next_fire(self, after):
+        return after + self.interval
+
+    def runcommands(self):
+        data = {'time': time.time(), 'queue_depth': self.plugin._executor.queueDepth(), 'tasks': []}
+        for task in self.plugin._tasks or []:
+            entry = task.stats.toDict()
+            entry['name'] = task.name
+            entry['type'] = task.__class__.__name__
+            data['tasks'].append(entry)
+        for c in self.plugin._calendars:
+            entry = c.eventStats.toDict()
+            entry['name'] = c.name
+            entry['type'] = c.__class__.__name__
+            entry['loaded_events'] = len(c.events)
+            data['tasks'].append(entry)
+        if self.plugin._fleet is not None and self.plugin._fleet.servers:
+            data['servers'] = []
+            for server in self.plugin._fleet.servers.values():
+                entry = server.stats.toDict()
+                entry['name'] = server.name
+                entry['unreachable'] = server.link.breaker.isOpen()
+                entry['last_error'] = server.lastError
+                data['servers'].append(entry)
+        atomic_write(self.path, json.dumps(data, indent=1, sort_keys=True))
+
+
+class ScheduleSimulator(object):
+    """
+    Enumerate the runs of recurring tasks over a time window, without running
+    them. Each task only computes its next occurrences, so long windows are
+    fast. Runs are merged in time order and aggregated on the fly :
+    runs per minute histogram, busiest minutes, seconds where many tasks fire
+    at once and number of commands sent to the game server
+    """
+    def __init__(self, tasks, top=10, collision=2):
+        self.tasks = [t for t in tasks if t.next_fire(0) is not None]
+        self.top = top
+        self.collision = collision
+
+    def fires(self, start, end):
+        """
+        yield (timestamp, task) for every run between start (excluded) and
+        end (included), in time order
+        """
+        heap = []
+        for i, task in enumerate(self.tasks):
+            times = task.fire_times(start, end)
+            for when in times:
+                heap.append((when, i, task, times.next))
+                break
+        heapq.heapify(heap)
+        while heap:
+            when, i, task, nextTime = heap[0]
+            yield when, task
+            try:
+                heapq.heapreplace(heap, (nextTime(), i, task, nextTime))
+            except StopIteration:
+                heapq.heappop(heap)
+
+    def run(self, start, end):
+        """
+        return a dict describing the load between start and end
+        """
+        commandCounts = dict([(t, t.serverCommandCount()) for t in self.tasks])
+        perMinute = {}
+        busiestMinutes = []
+        collisions = []
+        result = {'start': start, 'end': end, 'tasks': len(self.tasks), 'runs': 0, 'commands': 0,
+            'peak_commands_per_second': 0}
+
+        def flushMinute(minute, runs):
+            perMinute[runs] = perMinute.get(runs, 0) + 1
+            self._keepTop(busiestMinutes, (runs, -minute))
+
+        def flushSecond(second, tasks):
+            commands = sum([commandCounts[t] for t in tasks])
+            if commands > result['peak_commands_per_second']:
+                result['peak_commands_per_second'] = commands
+            if len(tasks) >= self.collision:
+                self._keepTop(collisions, (len(tasks), -second, tuple([t.name for t in tasks])))
+
+        minute = second = None
+        minuteRuns = 0
+        secondTasks = []
+        for when, task in self.fires(start, end):
+            result['runs'] += 1
+            result['commands'] += commandCounts[task]
+            if when != second:
+                if secondTasks:
+                    flushSecond(second, secondTasks)
+                second, secondTasks = when, []
+            secondTasks.append(task)
+            if when // 60 != minute:
+                if minuteRuns:
+                    flushMinute(minute * 60, minuteRuns)
+                minute, minuteRuns = when // 60, 0
+            minuteRuns += 1
+        if secondTasks:
+            flushSecond(second, secondTasks)
+        if minuteRuns:
+            flushMinute(minute * 60, minuteRuns)
+
+        # minutes without any run
+        perMinute[0] = max(0, int((end - start) // 60) - sum(perMinute.values()))
+        result['runs_per_minute'] = perMinute
+        # busiest first, then earliest first
+        result['busiest_minutes'] = [(-m, runs) for runs, m in sorted(busiestMinutes, reverse=True)]
+        result['collisions'] = [(-s, names) for count, s, names in sorted(collisions, reverse=True)]
+        return result
+
+    def _keepTop(self, top, item):
+        if len(top) < self.top:
+            heapq.heappush(top, item)
+        elif item > top[0]:
+            heapq.heapreplace(top, item)
+
+
+class RunJournal(object):
+    """
+    Append-only file of the last run time of each task, one 'timestamp key'
+    line per run. The last line of a key wins. Lines are buffered and written
+    by a background thread at most every flushInterval seconds, followed by a
+    single fsync. The file is rewritten with one line per key once it holds
+    too many outdated lines
+    """
+    flushInterval = 5
+    compactAfter = 1000
+
+    def __init__(self, plugin, path):
+        self.plugin = plugin
+        self.path = path
+        self.entries = {}
+        self._lines = 0
+        self._pending = []
+        self._lock = threading.Lock()
+        self._stopEvent = threading.Event()
+        self._thread = None
+
+    def load(self):
+        """
+        read the journal. Unreadable lines (ie: a line cut by a crash) are
+        ignored
+        """
+        self.entries = {}
+        self._lines = 0
+        try:
+            f = open(self.path, 'r')
+        except IOError:
+            return
+        try:
+            for line in f:
+                try:
+                    when, key = line.rstrip('\n').split(' ', 1)
+                    self.entries[key.decode('utf-8')] = int(when)
+                except ValueError:
+                    continue
+                self._lines += 1
+        finally:
+            f.close()
+        if self._lines > len(self.entries) + self.compactAfter:
+            self.compact()
+
+    def last(self, key):
+        return self.entries.get(key)
+
+    def record(self, key, when):
+        self._lock.acquire()
+        try:
+            if when <= self.entries.get(key, 0):
+                return
+            self.entries[key] = int(when)
+            self._pending.append(self._line(key, when))
+        finally:
+            self._lock.release()
+
+    def start(self):
+        self._stopEvent.clear()
+        self._thread = threading.Thread(target=self._run, name='scheduler journal')
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopEvent.set()
+        if self._thread:
+            self._thread.join(self.flushInterval + 1)
+            self._thread = None
+        self.flush()
+
+    def flush(self):
+        """
+        append the pending lines to the journal and sync it to disk
+        """
+        self._lock.acquire()
+        try:
+            lines, self._pending = self._pending, []
+        finally:
+            self._lock.release()
+        if not lines:
+            return
+        try:
+            f = open(self.path, 'a')
+            try:
+                f.write(''.join(lines))
+                f.flush()
+                os.fsync(f.fileno())
+            finally:
+                f.close()
+        except (IOError, OSError), e:
+            self.plugin.error("could not write journal %s : %s" % (self.path, e))
+            return
+        self._lines += len(lines)
+        if self._lines > len(self.entries) + self.compactAfter:
+            self.compact()
+
+    def compact(self):
+        """
+        rewrite the journal with only the last run of each task
+        """
+        self._lock.acquire()
+        try:
+            lines = [self._line(key, when) for key, when in sorted(self.entries.items())]
+        finally:
+            self._lock.release()
+        try:
+            atomic_write(self.path, ''.join(lines))
+        except (IOError, OSError), e:
+            self.plugin.error("could not compact journal %s : %s" % (self.path, e))
+            return
+        self._lines = len(lines)
+
+    def _line(self, key, when):
+        return '%d %s\n' % (when, key.replace('\n', ' ').encode('utf-8'))
+
+    def _run(self):
+        while not self._stopEvent.isSet():
+            self._stopEvent.wait(self.flushInterval)
+            self.flush()
+
+
+class FileLeaseStore(object):
+    """
+    lease record kept in a local file as 'expires owner', read and written
+    under an exclusive lock on the file
+    """
+
+    def __init__(self, path):
+        if fcntl is None:
+            raise TaskConfigError("lease files are not supported on this system, use the sqlite lease_backend")
+        self.path = path
+
+    def claim(self, owner, now, ttl):
+        """
+        take or renew the lease for owner if it is free, expired or already
+        held by owner. Return the new expiry time, or None if another owner
+        holds it
+        """
+        f = os.fdopen(os.open(self.path, os.O_RDWR | os.O_CREAT), 'r+')
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                expires, holder = self._parse(f.read())
+                if holder not in (None, owner) and expires > now:
+                    return None
+                f.seek(0)
+                f.truncate()
+                f.write('%.3f %s\n' % (now + ttl, owner))
+                f.flush()
+                os.fsync(f.fileno())
+                return now + ttl
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        finally:
+            f.close()
+
+    def release(self, owner):
+        f = os.fdopen(os.open(self.path, os.O_RDWR | os.O_CREAT), 'r+')
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                if self._parse(f.read())[1] == owner:
+                    f.seek(0)
+                    f.truncate()
+                    f.flush()
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        finally:
+            f.close()
+
+    def _parse(self, data):
+        try:
+            expires, holder = data.strip().split(' ', 1)
+            return float(expires), holder
+        except ValueError:
+            return 0, None
+
+
+class SqliteLeaseStore(object):
+    """
+    lease records kept in a SQLite database, one row per lease name so that
+    the B3 instances of several game servers can share the database
+    """
+
+    def __init__(self, path, name):
+        if sqlite3 is None:
+            raise TaskConfigError("the sqlite lease_backend requires the sqlite3 python module")
+        self.path = path
+        self.name = name
+        db = self._connect()
+        try:
+            db.execute("CREATE TABLE IF NOT EXISTS scheduler_lease (name TEXT PRIMARY KEY, owner TEXT, expires REAL)")
+        finally:
+            db.close()
+
+    def claim(self, owner, now, ttl):
+        db = self._connect()
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                row = db.execute("SELECT owner, expires FROM scheduler_lease WHERE name = ?", (self.name,)).fetchone()
+                if row is not None and row[0] != owner and row[1] > now:
+                    return None
+                db.execute("INSERT OR REPLACE INTO scheduler_lease (name, owner, expires) VALUES (?, ?, ?)",
+                    (self.name, owner, now + ttl))
+                return now + ttl
+            finally:
+                db.execute("COMMIT")
+        finally:
+            db.close()
+
+    def release(self, owner):
+        db = self._connect()
+        try:
+            db.execute("DELETE FROM scheduler_lease WHERE name = ? AND owner = ?", (self.name, owner))
+        finally:
+            db.close()
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=10)
+        db.isolation_level = None
+        return db
+
+
+class Lease(object):
+    """
+    Leader election between B3 instances running the same tasks against the
+    same game server : only the instance holding the lease runs tasks. A
+    background thread claims or renews the lease every ttl / 3 seconds, so
+    checking it when a task fires only compares the time with the expiry of
+    the last renewal. If the holder dies, its lease expires and a standby
+    takes it over within ttl + ttl / 3 seconds
+    """
+    defaultTtl = 30
+
+    def __init__(self, plugin, store, ttl=defaultTtl, clock=time.time):
+        self.plugin = plugin
+        self.store = store
+        self.ttl = ttl
+        self.clock = clock
+        self.owner = '%s:%s:%s' % (socket.gethostname(), os.getpid(), hashlib.md5(os.urandom(16)).hexdigest()[:8])
+        self.expires = 0
+        self.leader = False
+        self._stopEvent = threading.Event()
+        self._thread = None
+
+    def held(self):
+        return self.clock() < self.expires
+
+    def renew(self):
+        try:
+            expires = self.store.claim(self.owner, self.clock(), self.ttl)
+        except Exception, e:
+            # keep running until the lease we already have expires
+            self.plugin.error("could not renew the scheduler lease : %s" % e)
+        else:
+            self.expires = expires or 0
+        held = self.held()
+        if held and not self.leader:
+            self.plugin.info("this B3 instance now holds the scheduler lease and runs the tasks")
+        elif self.leader and not held:
+            self.plugin.warning("scheduler lease lost, tasks are left to the other B3 instance")
+        self.leader = held
+
+    def start(self):
+        self._stopEvent.clear()
+        self._thread = threading.Thread(target=self._run, name='scheduler lease')
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        stop renewing the lease and give it up so a standby takes over now
+        """
+        self._stopEvent.set()
+        if self._thread:
+            self._thread.join(1)
+            self._thread = None
+        self.expires = 0
+        self.leader = False
+        try:
+            self.store.release(self.owner)
+        except Exception, e:
+            self.plugin.error("could not release the scheduler lease : %s" % e)
+
+    def _run(self):
+        while not self._stopEvent.isSet():
+            self._stopEvent.wait(self.ttl / 3.0)
+            if not self._stopEvent.isSet():
+                self.renew()
+
+
+class CatchUpRun(object):
+    """
+    One-shot job running the commands of a task once for each of the given
+    missed run times
+    """
+    ## never catch up more runs than that
+    maxRuns = 100
+    overlap = 'queue'
+
+    def __init__(self, task, times):
+        self.task = task
+        self.times = times
+        self.name = '%s (catch up)' % task.name
+        self.plugin = task.plugin
+        self.stats = TaskStats()
+
+    def journalKey(self):
+        return self.task.journalKey()
+
+    def next_fire(self, after):
+        return None
+
+    def runcommands(self):
+        ok = True
+        for when in self.times:
+            ok = self.task.runcommands() and ok
+        return ok
+
+
+class GameState(object):
+    """
+    Snapshot of the game state B3 already knows (connected players, map,
+    gametype, enabled plugins). It is refreshed at most every ttl seconds so
+    task conditions do not cost any rcon query
+    """
+    defaultTtl = 10
+
+    def __init__(self, console, ttl=defaultTtl, clock=time.time):
+        self.console = console
+        self.ttl = ttl
+        self.clock = clock
+        self._snapshot = None
+        self._expires = 0
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        self._lock.acquire()
+        try:
+            self._snapshot = None
+        finally:
+            self._lock.release()
+
+    def get(self, key):
+        """
+        return one of players, map, gametype
+        """
+        return self._current()[key]
+
+    def pluginEnabled(self, name):
+        snapshot = self._current()
+        plugins = snapshot['plugins']
+        if name not in plugins:
+            plugin = self.console.getPlugin(name)
+            plugins[name] = plugin is not None and plugin.isEnabled()
+        return plugins[name]
+
+    def _current(self):
+        self._lock.acquire()
+        try:
+            now = self.clock()
+            if self._snapshot is None or now >= self._expires:
+                game = self.console.game
+                self._snapshot = {
+                    'players': len(self.console.clients.getList()),
+                    'map': game and game.mapName or None,
+                    'gametype': game and game.gameType or None,
+                    'plugins': {},
+                }
+                self._expires = now + self.ttl
+            return self._snapshot
+        finally:
+            self._lock.release()
+
+
+class TaskGuard(object):
+    """
+    Conditions a task checks against the game state before running its
+    commands, read from the task attributes min_players, max_players, map,
+    gametype (comma separated lists) and plugin_enabled
+    """
+    attributes = ('min_players', 'max_players', 'map', 'gametype', 'plugin_enabled')
+
+    def __init__(self, attrib):
+        self.minPlayers = self._int(attrib, 'min_players')
+        self.maxPlayers = self._int(attrib, 'max_players')
+        self.maps = self._list(attrib, 'map')
+        self.gametypes = self._list(attrib, 'gametype')
+        self.plugin = attrib.get('plugin_enabled', '').strip() or None
+
+    @classmethod
+    def fromAttributes(cls, attrib):
+        """
+        return the guard of a task or None if it has no condition
+        """
+        for name in cls.attributes:
+            if name in attrib:
+                return cls(attrib)
+        return None
+
+    def check(self, state):
+        """
+        return why the task must not run, or None if it can run
+        """
+        if self.minPlayers is not None or self.maxPlayers is not None:
+            players = state.get('players')
+            if self.minPlayers is not None and players < self.minPlayers:
+                return "%s players, less than %s" % (players, self.minPlayers)
+            if self.maxPlayers is not None and players > self.maxPlayers:
+                return "%s players, more than %s" % (players, self.maxPlayers)
+        if self.maps and ("%s" % state.get('map')).lower() not in self.maps:
+            return "map is %s" % state.get('map')
+        if self.gametypes and ("%s" % state.get('gametype')).lower() not in self.gametypes:
+            return "gametype is %s" % state.get('gametype')
+        if self.plugin and not state.pluginEnabled(self.plugin):
+            return "plugin %s is not enabled" % self.plugin
+        return None
+
+    def __repr__(self):
+        return "TaskGuard(players %s-%s, maps %s, gametypes %s, plugin %s)" % (self.minPlayers, self.maxPlayers,
+            self.maps, self.gametypes, self.plugin)
+
+    @staticmethod
+    def _int(attrib, name):
+        if name not in attrib:
+            return None
+        try:
+            return int(attrib[name])
+        except ValueError:
+            raise TaskConfigError('%s must be a number' % name)
+
+    @staticmethod
+    def _list(attrib, name):
+        return [x.strip().lower() for x in attrib.get(name, '').split(',') if x.strip()]
+
+
+class CvarCache(object):
+    """
+    Values of the cvars last set by tasks. Cleared whenever the game server
+    may have reset them (map change, game exit, failed rcon write)
+    """
+    def __init__(self):
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        return self._values.get(name.lower())
+
+    def set(self, name, value):
+        self._lock.acquire()
+        try:
+            self._values[name.lower()] = value
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._values.clear()
+        finally:
+            self._lock.release()
+
+    def forget(self, text):
+        """
+        drop the cached value of the cvar the rcon command text sets, if any
+        """
+        if not self._values:
+            return
+        match = CvarCommand.pattern.match(text)
+        if match:
+            self._lock.acquire()
+            try:
+                self._values.pop(match.group('name').lower(), None)
+            finally:
+                self._lock.release()
+
+
+def attributeIsTrue(value):
+    return ("%s" % value).strip().lower() in ('yes', 'true', 'on', '1')
+
+
+class DeferredRun(CatchUpRun):
+    """
+    One-shot job running a task which was deferred while the game server was
+    unreachable
+    """
+    def __init__(self, task, commands=None):
+        CatchUpRun.__init__(self, task, [None])
+        self.name = '%s (deferred)' % task.name
+        self.commands = commands
+
+    def runcommands(self):
+        if self.plugin._deferredRuns.get(self.task) is self:
+            del self.plugin._deferredRuns[self.task]
+        return self.task.runcommands(self.commands)
+
+
+class CommandTimeout(Exception): pass
+
+class CircuitOpen(Exception):
+    """
+    a command was not sent because the game server is considered unreachable.
+    remaining holds the commands left unsent by a command made of several
+    ones (see FrostbitePipeline)
+    """
+    remaining = None
+
+
+class CircuitBreaker(object):
+    """
+    Count consecutive failed commands. After threshold of them the circuit
+    opens : commands fail right away for resetTimeout seconds. Then a single
+    probe command is let through, which closes the circuit if it succeeds or
+    opens it again if it fails
+    """
+    defaultThreshold = 5
+    defaultResetTimeout = 30
+
+    def __init__(self, threshold=defaultThreshold, resetTimeout=defaultResetTimeout, clock=time.time):
+        self.threshold = threshold
+        self.resetTimeout = resetTimeout
+        self.clock = clock
+        self.failures = 0
+        self.openedAt = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def isOpen(self):
+        return self.openedAt is not None
+
+    def allow(self, probe=True):
+        """
+        tell if a command can be sent. When the reset timeout is over, return
+        True for one probe command, or just tell a probe would be allowed if
+        probe is False
+        """
+        self._lock.acquire()
+        try:
+            if self.openedAt is None:
+                return True
+            if self._probing or self.clock() < self.openedAt + self.resetTimeout:
+                return False
+            if probe:
+                self._probing = True
+            return True
+        finally:
+            self._lock.release()
+
+    def retryAt(self):
+        if self.openedAt is None:
+            return self.clock()
+        return max(self.clock(), self.openedAt + self.resetTimeout)
+
+    def success(self):
+        self._lock.acquire()
+        try:
+            self.failures = 0
+            self.openedAt = None
+            self._probing = False
+        finally:
+            self._lock.release()
+
+    def failure(self):
+        """
+        record a failed command. Return True if this opened the circuit
+        """
+        self._lock.acquire()
+        try:
+            self.failures += 1
+            if self._probing or (self.openedAt is None and self.failures >= self.threshold):
+                opened = self.openedAt is None
+                self.openedAt = self.clock()
+                self._probing = False
+                return opened
+            return False
+        finally:
+            self._lock.release()
+
+
+class ServerLink(object):
+    """
+    Send commands to the game server with a timeout, retries with exponential
+    backoff for transient errors and a circuit breaker.
+
+    With a timeout, commands are run by a pool of caller threads so a hung
+    call can be given up on. A caller thread stuck in such a call is replaced
+    by a new one when needed, up to maxCallers threads. Once they are all
+    stuck, commands time out at once instead of starting more threads
+    """
+    defaultTimeout = 10
+    defaultRetries = 2
+    defaultBackoff = 1
+    ## at most that many caller threads, stuck in a hung call or not
+    maxCallers = 8
+    ## errors meaning the game server answered but refused the command
+    permanentErrors = ('CommandFailedError', 'CommandError', 'RemoteCommandError')
+
+    def __init__(self, plugin, timeout=defaultTimeout, retries=defaultRetries, backoff=defaultBackoff, clock=time.time,
+            sleep=time.sleep, name='game server'):
+        self.plugin = plugin
+        self.name = name
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.sleep = sleep
+        self.breaker = CircuitBreaker(clock=clock)
+        self._calls = Queue.Queue()
+        # calls queued or being run, caller threads, calls given up on but still running
+        self._pending = 0
+        self._callers = 0
+        self._stuck = 0
+        self._lock = threading.Lock()
+
+    def call(self, func, *args, **kwargs):
+        """
+        return func(*args). Raise CircuitOpen without calling func if the
+        game server is considered unreachable
+        """
+        retries = kwargs.get('retries', self.retries)
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                raise CircuitOpen("%s unreachable, command not sent" % self.name)
+            try:
+                result = self._callWithTimeout(func, args)
+            except Exception, e:
+                if e.__class__.__name__ in self.permanentErrors:
+                    self.breaker.success()
+                    raise
+                if self.breaker.failure():
+                    self.plugin.warning("%s unreachable after %s failed commands, deferring tasks for %ss" % (
+                        self.name, self.breaker.failures, self.breaker.resetTimeout))
+                if attempt >= retries or self.breaker.isOpen():
+                    raise
+                delay = self.backoff * 2 ** attempt
+                attempt += 1
+                self.plugin.debug("%s, retrying in %ss" % (e, delay))
+                self.sleep(delay)
+            else:
+                if self.breaker.isOpen():
+                    self.plugin.info("%s reachable again" % self.name)
+                self.breaker.success()
+                return result
+
+    def _callWithTimeout(self, func, args):
+        if not self.timeout or self.timeout <= 0:
+            return func(*args)
+        call = PendingCall(func, args)
+        self._lock.acquire()
+        try:
+            if self._pending >= self._callers:
+                # no idle caller thread
+                if self._callers < self.maxCallers:
+                    thread = threading.Thread(target=self._caller, name='scheduler command')
+                    thread.setDaemon(True)
+                    thread.start()
+                    self._callers += 1
+                elif self._stuck >= self._callers:
+                    raise CommandTimeout("%s commands to the %s are still hung" % (self._stuck, self.name))
+            self._pending += 1
+        finally:
+            self._lock.release()
+        self._calls.put(call)
+        call.done.wait(self.timeout)
+        self._lock.acquire()
+        try:
+            if call.state == 'queued':
+                # no caller thread picked it up, it must not be sent late
+                call.state = 'abandoned'
+            elif call.state == 'running':
+                call.state = 'stuck'
+                self._stuck += 1
+        finally:
+            self._lock.release()
+        if call.outcome is None:
+            raise CommandTimeout("no response from the game server after %ss" % self.timeout)
+        ok, value = call.outcome
+        if not ok:
+            raise value
+        return value
+
+    def _caller(self):
+        while True:
+            call = self._calls.get()
+            self._lock.acquire()
+            try:
+                run = call.state == 'queued'
+                if run:
+                    call.state = 'running'
+            finally:
+                self._lock.release()
+            if run:
+                try:
+                    outcome = (True, call.func(*call.args))
+                except Exception, e:
+                    outcome = (False, e)
+            self._lock.acquire()
+            try:
+                if run and call.state == 'stuck':
+                    self._stuck -= 1
+                elif run:
+                    call.outcome = outcome
+                call.state = 'done'
+                self._pending -= 1
+            finally:
+                self._lock.release()
+            call.done.set()
+
+
+class PendingCall(object):
+    """
+    a call waiting for or run by a ServerLink caller thread. Its state goes
+    from queued to running then done, or to abandoned or stuck when the
+    caller gave up on it
+    """
+    __slots__ = ('func', 'args', 'state', 'outcome', 'done')
+
+    def __init__(self, func, args):
+        self.func = func
+        self.args = args
+        self.state = 'queued'
+        self.outcome = None
+        self.done = threading.Event()
+
+
+class RemoteCommandError(Exception): pass
+
+
+class Q3RconConnection(object):
+    """
+    rcon connection to a Quake3 based game server, over UDP. The response is
+    made of the packets received until none comes for drain seconds
+    """
+    header = '\377\377\377\377'
+    drain = 0.1
+
+    def __init__(self, host, port, password, timeout):
+        self.password = password
+        self.timeout = timeout or None
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.connect((host, port))
+
+    def command(self, text):
+        if isinstance(text, unicode):
+            text = text.encode('utf-8', 'replace')
+        self.socket.settimeout(self.timeout)
+        self.socket.send('%srcon "%s" %s\n' % (self.header, self.password, text.strip()))
+        packets = [self.socket.recv(65536)]
+        self.socket.settimeout(self.drain)
+        try:
+            while True:
+                packets.append(self.socket.recv(65536))
+        except socket.timeout:
+            pass
+        data = ''.join([x.replace(self.header + 'print\n', '', 1) for x in packets]).strip()
+        if data.startswith('Bad rconpassword') or data.startswith('No rconpassword set'):
+            raise RemoteCommandError(data)
+        return data
+
+    def close(self):
+        self.socket.close()
+
+
+class FrostbiteConnection(object):
+    """
+    connection to a Frostbite game server, over TCP. It is logged in with
+    the hashed password when opened
+    """
+
+    def __init__(self, host, port, password, timeout):
+        if frostbiteProtocol is None:
+            raise RemoteCommandError("frostbite servers require B3 1.8 or later")
+        self._buffer = ''
+        self._sequence = 0
+        self.socket = socket.create_connection((host, port), timeout or None)
+        try:
+            salt = self.command(('login.hashed',))[0]
+            self.command(('login.hashed', frostbiteProtocol.generatePasswordHash(salt.decode('hex'), password).encode('hex').upper()))
+        except Exception:
+            self.socket.close()
+            raise
+
+    def command(self, cmdlist):
+        sequence = self._sequence
+        self._sequence = (sequence + 1) & 0x3fffffff
+        self.socket.sendall(frostbiteProtocol.EncodePacket(False, False, sequence, cmdlist))
+        while True:
+            packet, self._buffer = frostbiteProtocol.receivePacket(self.socket, self._buffer)
+            fromServer, isResponse, number, words = frostbiteProtocol.DecodePacket(packet)
+            if isResponse and number == sequence:
+                break
+        if not words or words[0] != 'OK':
+            raise RemoteCommandError("%s failed : %s" % (cmdlist[0], ' '.join(words)))
+        return words[1:]
+
+    def close(self):
+        self.socket.close()
+
+
+class RemoteServer(object):
+    """
+    a game server of the fleet, from a <server> element of the config
+    """
+
+    def __init__(self, name, game, host, port, password, groups=()):
+        self.name = name
+        self.game = game
+        self.host = host
+        self.port = port
+        self.password = password
+        self.groups = tuple(groups)
+        self.kind = game in FROSTBITE_GAMES and 'frostbite' or 'rcon'
+        self.link = None
+        self.stats = TaskStats()
+        self.lastError = None
+
+    @classmethod
+    def fromConfig(cls, node):
+        attrib = node.attrib
+        for name in ('name', 'game', 'host', 'port'):
+            if not attrib.get(name, '').strip():
+                raise TaskConfigError("cannot find '%s' attribute for a server element" % name)
+        try:
+            port = int(attrib['port'])
+        except ValueError:
+            raise TaskConfigError("invalid port for server %s" % attrib['name'])
+        groups = [x.strip() for x in attrib.get('group', '').split(',') if x.strip()]
+        return cls(attrib['name'].strip(), attrib['game'].strip().lower(), attrib['host'].strip(), port,
+            attrib.get('password', ''), groups)
+
+    def key(self):
+        return self.name, self.game, self.host, self.port, self.password, self.groups
+
+    def connect(self, timeout):
+        if self.kind == 'frostbite':
+            return FrostbiteConnection(self.host, self.port, self.password, timeout)
+        return Q3RconConnection(self.host, self.port, self.password, timeout)
+
+    def __repr__(self):
+        return "%s server %s (%s:%s)" % (self.game, self.name, self.host, self.port)
+
+
+class ConnectionPool(object):
+    """
+    Connections to the fleet game servers. At most size connections are open
+    at once, across all servers. Idle connections are kept for reuse and when
+    the pool is full, the oldest idle connection to another server is closed
+    to make room for a new one
+    """
+    defaultSize = 10
+
+    def __init__(self, size=defaultSize, timeout=ServerLink.defaultTimeout):
+        self.size = size
+        self.timeout = timeout
+        self.opened = 0
+        self._idle = []
+        self._cond = threading.Condition()
+
+    def acquire(self, server):
+        self._cond.acquire()
+        try:
+            deadline = self.timeout and time.time() + self.timeout
+            while True:
+                for i in range(len(self._idle) - 1, -1, -1):
+                    if self._idle[i][0] is server:
+                        return self._idle.pop(i)[1]
+                if self.opened < self.size:
+                    self.opened += 1
+                    break
+                if self._idle:
+                    self._idle.pop(0)[1].close()
+                    self.opened -= 1
+                    continue
+                remaining = deadline and deadline - time.time()
+                if deadline and remaining <= 0:
+                    raise CommandTimeout("no free connection after %ss" % self.timeout)
+                self._cond.wait(remaining or None)
+        finally:
+            self._cond.release()
+        try:
+            return server.connect(self.timeout)
+        except Exception:
+            self._closed()
+            raise
+
+    def release(self, server, connection, broken=False):
+        """
+        give a connection back to the pool. Broken connections are closed
+        """
+        if broken:
+            connection.close()
+            self._closed()
+            return
+        self._cond.acquire()
+        try:
+            self._idle.append((server, connection))
+            self._cond.notify()
+        finally:
+            self._cond.release()
+
+    def discard(self, server=None):
+        """
+        close the idle connections to server, or to all servers
+        """
+        self._cond.acquire()
+        try:
+            keep = []
+            for s, connection in self._idle:
+                if server is None or s is server:
+                    connection.close()
+                    self.opened -= 1
+                else:
+                    keep.append((s, connection))
+            self._idle = keep
+            self._cond.notifyAll()
+        finally:
+            self._cond.release()
+
+    def _closed(self):
+        self._cond.acquire()
+        try:
+            self.opened -= 1
+            self._cond.notify()
+        finally:
+            self._cond.release()
+
+
+class Fleet(object):
+    """
+    Remote game servers tasks can target with their 'servers' attribute, by
+    server or group name. A task run sends its commands to all its target
+    servers at once from a pool of threads, as large as the connection pool.
+    Commands to one server are sent in order and each server has its own
+    retries and circuit breaker (see ServerLink)
+    """
+
+    def __init__(self, plugin, size=ConnectionPool.defaultSize):
+        self.plugin = plugin
+        self.servers = {}
+        self.groups = {}
+        self.pool = ConnectionPool(size)
+        self._jobs = Queue.Queue()
+        self._threads = 0
+        self._lock = threading.Lock()
+
+    def load(self, nodes):
+        """
+        load the servers from the <server> elements of the config. Unchanged
+        servers keep their connections and results
+        """
+        previous = self.servers
+        servers = {}
+        groups = {}
+        for node in nodes:
+            try:
+                server = RemoteServer.fromConfig(node)
+            except TaskConfigError, e:
+                self.plugin.error(e)
+                continue
+            if server.name in servers:
+                self.plugin.error("duplicate server name %s" % server.name)
+                continue
+            old = previous.get(server.name)
+            if old is not None and old.key() == server.key():
+                server = old
+            servers[server.name] = server
+            for group in server.groups:
+                groups.setdefault(group, []).append(server.name)
+        for name, old in previous.items():
+            if servers.get(name) is not old:
+                self.pool.discard(old)
+        self.servers = servers
+        self.groups = groups
+        link = self.plugin._link
+        for server in servers.values():
+            if server.link is None:
+                server.link = ServerLink(self.plugin, timeout=0, name='%s server %s' % (server.game, server.name))
+            server.link.retries = link.retries
+            server.link.backoff = link.backoff
+            server.link.breaker.threshold = link.breaker.threshold
+            server.link.breaker.resetTimeout = link.breaker.resetTimeout
+        self.pool.timeout = link.timeout
+
+    def resolve(self, names):
+        """
+        return the servers designated by a list of server names, group names
+        or '*' for all servers
+        """
+        found = []
+        for name in names:
+            if name == '*':
+                targets = sorted(self.servers)
+            elif name in self.servers:
+                targets = [name]
+            elif name in self.groups:
+                targets = self.groups[name]
+            else:
+                raise TaskConfigError("unknown server or group %s" % name)
+            for target in targets:
+                if self.servers[target] not in found:
+                    found.append(self.servers[target])
+        return found
+
+    def fanOut(self, task, servers, command):
+        """
+        send the commands of a FleetCommand to servers concurrently and wait
+        for all of them. Return a dict of server name : (ok, result or error)
+        """
+        results = {}
+        done = threading.Event()
+        pending = [len(servers)]
+        if not servers:
+            return results
+        self._lock.acquire()
+        try:
+            while self._threads < min(len(servers), self.pool.size):
+                thread = threading.Thread(target=self._work, name='scheduler fleet')
+                thread.setDaemon(True)
+                thread.start()
+                self._threads += 1
+        finally:
+            self._lock.release()
+        for server in servers:
+            self._jobs.put((task, server, command.commandsFor(server), results, pending, done))
+        done.wait()
+        return results
+
+    def stop(self):
+        self.pool.discard()
+
+    def _work(self):
+        while True:
+            task, server, commands, results, pending, done = self._jobs.get()
+            try:
+                results[server.name] = self._runOn(task, server, commands)
+            except Exception, e:
+                results[server.name] = (False, "%s" % e)
+            self._lock.acquire()
+            try:
+                pending[0] -= 1
+                if not pending[0]:
+                    done.set()
+            finally:
+                self._lock.release()
+
+    def _runOn(self, task, server, commands):
+        result = None
+        for cmd in commands:
+            start = time.time()
+            try:
+                result = server.link.call(self._send, server, cmd)
+            except Exception, e:
+                latency = time.time() - start
+                task.stats.commandDone(latency, False)
+                server.stats.commandDone(latency, False)
+                server.lastError = "%s" % e
+                return False, server.lastError
+            latency = time.time() - start
+            task.stats.commandDone(latency, True)
+            server.stats.commandDone(latency, True)
+        server.lastError = None
+        return True, result
+
+    def _send(self, server, cmd):
+        connection = self.pool.acquire(server)
+        try:
+            result = connection.command(cmd)
+        except RemoteCommandError:
+            self.pool.release(server, connection)
+            raise
+        except Exception:
+            self.pool.release(server, connection, broken=True)
+            raise
+        self.pool.release(server, connection)
+        return result
+
+
+class TaskConfigError(Exception): pass
+
+
+def taskFingerprint(config):
+    """
+    return a digest of a task XML element : its kind, name, schedule and
+    commands. Attribute values and texts are stripped so that formatting
+    changes in the config file do not make a task look modified
+    """
+    def nodeKey(node):
+        attrib = tuple(sorted([(k, ("%s" % v).strip()) for k, v in node.attrib.items()]))
+        text = (node.text or '').strip()
+        return node.tag, attrib, text, tuple([nodeKey(child) for child in node])
+    return hashlib.md5(repr(nodeKey(config))).digest()
+
+
+#--------------------------------------------------------------------------------------------------
+class Timezone(object):
+    """
+    Convert timestamps to wall clock times of a timezone and back, following
+    daylight saving time changes.
+
+    UTC offsets are cached per UTC day : for each day we keep the offset at
+    its start, the offset at its end and, when they differ, the second the
+    transition happens. Converting a timestamp then costs a dict lookup.
+    """
+    maxCachedDays = 1024
+
+    def __init__(self, name, offsetAt, fixed=False):
+        """
+        offsetAt is a function returning the UTC offset in seconds at a given
+        timestamp
+        """
+        self.name = name
+        self.fixed = fixed
+        self._offsetAt = offsetAt
+        self._days = {}
+
+    def __repr__(self):
+        return "Timezone(%s)" % self.name
+
+    def utcoffset(self, timestamp):
+        """
+        return the UTC offset in seconds in effect at timestamp
+        """
+        timestamp = int(timestamp)
+        try:
+            start, transition, end = self._days[timestamp // 86400]
+        except KeyError:
+            start, transition, end = self._cacheDay(timestamp // 86400)
+        if transition is None or timestamp < transition:
+            return start
+        return end
+
+    def localtime(self, timestamp):
+        """
+        return the wall clock time at timestamp as a time tuple
+        """
+        timestamp = int(timestamp)
+        return time.gmtime(timestamp + self.utcoffset(timestamp))
+
+    def timestamps(self, fields):
+        """
+        return the sorted list of timestamps at which the wall clock shows the
+        (year, month, day, hour, minute, second) fields. There are two of them
+        when clocks are set back and the wall clock time is repeated. When
+        clocks are set forward and the wall clock time does not exist, return
+        the timestamp it would have with the offset in effect before the change
+        (ie: 02:30 becomes 03:30)
+        """
+        wall = calendar.timegm(tuple(fields[:6]) + (0, 0, 0))
+        before = self.utcoffset(wall - 50400)
+        after = self.utcoffset(wall + 50400)
+        if before == after:
+            return [wall - before]
+        stamps = [wall - x for x in (before, after) if self.utcoffset(wall - x) == x]
+        if not stamps:
+            return [wall - before]
+        stamps.sort()
+        return stamps
+
+    def _cacheDay(self, day):
+        if len(self._days) >= self.maxCachedDays:
+            self._days.clear()
+        lo = day * 86400
+        hi = lo + 86399
+        start = self._offsetAt(lo)
+        end = self._offsetAt(hi)
+        transition = None
+        if start != end:
+            # find the first second of the day using the new offset
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if self._offsetAt(mid) == start:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            transition = lo
+        entry = self._days[day] = (start, transition, end)
+        return entry
+
+
+def _localOffset(timestamp):
+    return calendar.timegm(time.localtime(timestamp)) - timestamp
+
+def _tzinfoOffset(tzinfo):
+    def offsetAt(timestamp):
+        offset = datetime.datetime.fromtimestamp(timestamp, tzinfo).utcoffset()
+        return offset.days * 86400 + offset.seconds
+    return offsetAt
+
+def getTimezone(name):
+    """
+    return a Timezone for name which can be 'local' (the system timezone), a tz
+    database name such as 'Europe/Paris' (requires pytz) or a B3
+    timezone abbreviation (fixed UTC offset)
+    """
+    name = ("%s" % name).strip()
+    if name.lower() in ('', 'local'):
+        return Timezone('local', _localOffset)
+    if name.upper() == 'UTC':
+        return UTC
+    if pytz:
+        try:
+            return Timezone(name, _tzinfoOffset(pytz.timezone(name)))
+        except KeyError:
+            pass
+    if name.upper() in b3.timezones.timezones:
+        offset = int(round(b3.timezones.timezones[name.upper()] * 3600))
+        return Timezone(name.upper(), lambda timestamp: offset, fixed=True)
+    raise ValueError("unknown timezone %s" % name)
+
+UTC = Timezone('UTC', lambda timestamp: 0, fixed=True)
+
+
+#--------------------------------------------------------------------------------------------------
+class CronExpression(object):
+    """
+    A cron schedule compiled once into one bitmask per field.
+
+    Each field accepts the GNU cron syntax : '*', '5', '1-5', '*/15', '10-40/10',
+    '5/20' (from 5 to the end by steps of 20) and comma separated lists of those.
+    Months and days of week can also be given by name ('jan', 'mon', ...).
+    Days of week follow the B3 convention : 0 is monday, 6 is sunday.
+
+    >>> cron = CronExpression(seconds=0, minutes='*/15', hour='8-18', dow='mon-fri')
+    >>> cron.next_fire(1351771200) # 2012-11-01 12:00:00 UTC
+    1351772100
+    """
+    __slots__ = ('seconds', 'minutes', 'hours', 'days', 'months', 'dows', 'source', '_lastQuery')
+
+    ALL_HOURS = (1 << 24) - 1
+    MONTHS = ('jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec')
+    DAYS = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+    ## give up searching for a next occurrence after that many years (covers 29/02)
+    maxYears = 8
+
+    _fragment = re.compile(r'^(?:(?P<all>\*)|(?P<start>\w+)(?:-(?P<end>\w+))?)(?:/(?P<step>[0-9]+))?$')
+
+    ## compiled expressions of the current config by source fields, see compile()
+    _compiled = {}
+
+    def __init__(self, seconds=0, minutes='*', hour='*', day='*', month='*', dow='*'):
+        self._lastQuery = None
+        self.source = (seconds, minutes, hour, day, month, dow)
+        self.seconds = self._parse(seconds, 0, 59)
+        self.minutes = self._parse(minutes, 0, 59)
+        self.hours = self._parse(hour, 0, 23)
+        self.days = self._parse(day, 1, 31)
+        self.months = self._parse(month, 1, 12, self.MONTHS, 1)
+        self.dows = self._parse(dow, 0, 6, self.DAYS, 0)
+
+    @classmethod
+    def compile(cls, seconds=0, minutes='*', hour='*', day='*', month='*', dow='*'):
+        """
+        return a CronExpression, shared with the other tasks having the same
+        schedule
+        """
+        key = tuple([("%s" % x).strip() for x in (seconds, minutes, hour, day, month, dow)])
+        try:
+            return cls._compiled[key]
+        except KeyError:
+            return cls._compiled.setdefault(key, cls(seconds, minutes, hour, day, month, dow))
+
+    def __repr__(self):
+        return "CronExpression(%s)" % ' '.join(["%s" % x for x in self.source])
+
+    def __eq__(self, other):
+        return isinstance(other, CronExpression) and self._masks() == other._masks()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self._masks())
+
+    def _masks(self):
+        return self.seconds, self.minutes, self.hours, self.days, self.months, self.dows
+
+    @classmethod
+    def _parse(cls, value, lo, hi, names=None, nameOffset=0):
+        """
+        compile a cron field into a bitmask where bit N is set if the value N
+        matches
+        """
+        def toInt(x):
+            x = x.lower()
+            if names and x[:3] in names:
+                return names.index(x[:3]) + nameOffset
+            try:
+                return int(x)
+            except ValueError:
+                raise ValueError('"%s" is not a valid cron value' % value)
+
+        mask = 0
+        for fragment in ("%s" % value).replace(' ', '').split(','):
+            m = cls._fragment.match(fragment)
+            if not m:
+                raise ValueError('"%s" is not a valid cron value' % value)
+            if m.group('all'):
+                start, end = lo, hi
+            else:
+                start = toInt(m.group('start'))
+                if m.group('end') is not None:
+                    end = toInt(m.group('end'))
+                elif m.group('step') is not None:
+                    end = hi
+                else:
+                    end = start
+            step = 1
+            if m.group('step') is not None:
+                step = int(m.group('step'))
+                if step < 1:
+                    raise ValueError('"%s" : step must be greater than 0' % value)
+            if start < lo or end > hi:
+                raise ValueError('"%s" is out of accepted range %s-%s' % (value, lo, hi))
+            if start > end:
+                raise ValueError('%s cannot be greater than %s in "%s"' % (start, end, value))
+            for i in xrange(start, end + 1, step):
+                mask |= 1 << i
+        return mask
+
+    @staticmethod
+    def _nextBit(mask, start):
+        """
+        return the lowest set bit of mask which is at least start, or -1
+        """
+        m = mask >> start
+        if not m:
+            return -1
+        return start + (m & -m).bit_length() - 1
+
+    def match(self, timetuple):
+        """
+        tell if a time tuple (as returned by time.gmtime) matches
+        """
+        return bool((self.seconds >> timetuple[5]) & (self.minutes >> timetuple[4]) & (self.hours >> timetuple[3])
+            & (self.days >> timetuple[2]) & (self.months >> timetuple[1]) & (self.dows >> timetuple[6]) & 1)
 
-FROSTBITE_GAMES = ('bfbc2', 'moh', 'bf3')
+    def nextMatch(self, year, month, day, hour, minute, second):
+        """
+        return the first (year, month, day, hour, minute, second) tuple matching
+        this expression at or after the given one, or None
+        """
+        nextBit = self._nextBit
+        lastYear = year + self.maxYears
+        while year <= lastYear:
+            m = nextBit(self.months, month)
+            if m == -1:
+                year, month, day, hour, minute, second = year + 1, 1, 1, 0, 0, 0
+                continue
+            if m != month:
+                month, day, hour, minute, second = m, 1, 0, 0, 0
 
-#--------------------------------------------------------------------------------------------------
-class SchedulerPlugin(b3.plugin.Plugin):
-    _tasks = None
-    _tzOffset = 0
-    _restart_tasks = set()
-    
-    def onLoadConfig(self):
+            firstWeekday, numDays = calendar.monthrange(year, month)
+            d = day
+            while d <= numDays:
+                d = nextBit(self.days, d)
+                if d == -1 or d > numDays:
+                    d = numDays + 1
+                    break
+                if (self.dows >> ((firstWeekday + d - 1) % 7)) & 1:
+                    break
+                d += 1
+            if d > numDays:
+                month, day, hour, minute, second = month + 1, 1, 0, 0, 0
+                if month > 12:
+                    year, month = year + 1, 1
+                continue
+            if d != day:
+                day, hour, minute, second = d, 0, 0, 0
 
-        # remove eventual existing tasks
-        if self._tasks:
-            for t in self._tasks:
-                t.cancel()
-    
-        # Get time_zone from main B3 config
-        tzName = self.console.config.get('b3', 'time_zone').upper()
-        self._tzOffset = b3.timezones.timezones[tzName]
-    
-        # load cron tasks from config
-        self._tasks = []
+            h = nextBit(self.hours, hour)
+            if h == -1:
+                day, hour, minute, second = day + 1, 0, 0, 0
+                if day > numDays:
+                    month, day = month + 1, 1
+                    if month > 12:
+                        year, month = year + 1, 1
+                continue
+            if h != hour:
+                hour, minute, second = h, 0, 0
 
-        for taskconfig in self.config.get('restart'):
-            try:
-                task = RestartTask(self, taskconfig)
-                self._tasks.append(task)
-                self.info("restart task [%s] loaded" % task.name)
-            except Exception, e:
-                self.error(e)
+            mi = nextBit(self.minutes, minute)
+            if mi == -1:
+                hour, minute, second = hour + 1, 0, 0
+                if hour > 23:
+                    day, hour = day + 1, 0
+                    if day > numDays:
+                        month, day = month + 1, 1
+                        if month > 12:
+                            year, month = year + 1, 1
+                continue
+            if mi != minute:
+                minute, second = mi, 0
 
-        for taskconfig in self.config.get('cron'):
-            try:
-                task = CronTask(self, taskconfig)
-                self._tasks.append(task)
-                self.info("cron task [%s] loaded" % task.name)
-            except Exception, e:
-                self.error(e)
-     
-        # load hourly tasks from config
-        for taskconfig in self.config.get('hourly'):
+            s = nextBit(self.seconds, second)
+            if s == -1:
+                minute, second = minute + 1, 0
+                if minute > 59:
+                    hour, minute = hour + 1, 0
+                    if hour > 23:
+                        day, hour = day + 1, 0
+                        if day > numDays:
+                            month, day = month + 1, 1
+                            if month > 12:
+                                year, month = year + 1, 1
+                continue
+            return year, month, day, hour, minute, s
+        return None
+
+    def next_fire(self, after, zone=None):
+        """
+        return the timestamp of the first occurrence strictly after the given
+        timestamp, or None if this expression never matches. The expression is
+        evaluated against the wall clock of zone (UTC by default).
+
+        Wall clock times skipped when clocks are set forward fire right after
+        the change. Wall clock times repeated when clocks are set back fire
+        only once, unless the expression matches every hour.
+        """
+        if zone is None:
+            zone = UTC
+        after = int(after)
+        # tasks sharing this expression usually ask for the same occurrence
+        last = self._lastQuery
+        if last is not None and last[0] == after and last[1] is zone:
+            return last[2]
+        # start from the earliest wall clock time so we do not jump over the
+        # times skipped by a daylight saving change
+        offset = min(zone.utcoffset(after), zone.utcoffset(after + 1))
+        found = self._firstStamp(after + 1 + offset, after, zone)
+        if found is not None and zone.utcoffset(found) < zone.utcoffset(after + 1):
+            # clocks were set back in between : the wall clock times following
+            # the change are lower than the one we started from
+            lo, hi = after + 1, found
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if zone.utcoffset(mid) == zone.utcoffset(after + 1):
+                    lo = mid + 1
+                else:
+                    hi = mid
+            other = self._firstStamp(lo + zone.utcoffset(lo), after, zone)
+            if other is not None and other < found:
+                found = other
+        self._lastQuery = (after, zone, found)
+        return found
+
+    def fire_times(self, start, end, zone=None):
+        """
+        yield the timestamps of all occurrences after start (excluded) up to
+        end (included), as calling next_fire repeatedly would. The remaining
+        occurrences of a day without UTC offset change are generated at once
+        from the list of matching times of day
+        """
+        if zone is None:
+            zone = UTC
+        daySeconds = None
+        when = self.next_fire(start, zone)
+        while when is not None and when <= end:
+            yield when
+            offset = zone.utcoffset(when)
+            wall = when + offset
+            base = wall - wall % 86400 - offset
+            if zone.utcoffset(base + 86399) == offset:
+                if daySeconds is None:
+                    daySeconds = self._daySeconds()
+                for second in daySeconds[bisect.bisect_right(daySeconds, wall % 86400):]:
+                    when = base + second
+                    if when > end:
+                        return
+                    yield when
+            when = self.next_fire(when, zone)
+
+    def _daySeconds(self):
+        """
+        return the sorted list of the matching times of day, in seconds
+        """
+        seconds = [s for s in range(60) if self.seconds >> s & 1]
+        minutes = [m * 60 for m in range(60) if self.minutes >> m & 1]
+        return [h * 3600 + m + s for h in range(24) if self.hours >> h & 1 for m in minutes for s in seconds]
+
+    def _firstStamp(self, wall, after, zone):
+        """
+        return the first timestamp after the given one at which the wall clock
+        matches, searching wall clock times from wall
+        """
+        fields = self.nextMatch(*time.gmtime(wall)[:6])
+        while fields is not None:
+            stamps = zone.timestamps(fields)
+            if stamps[0] > after:
+                return stamps[0]
+            if stamps[-1] > after and self.hours == self.ALL_HOURS:
+                return stamps[-1]
+            fields = self.nextMatch(*time.gmtime(calendar.timegm(fields + (0, 0, 0)) + 1)[:6])
+        return None
+
+
+class Command(object):
+    """
+    a compiled task command. Commands are built once when the task is loaded
+    and are immutable afterward
+    """
+    __slots__ = ()
+
+    def run(self, task):
+        raise NotImplementedError
+
+    def key(self):
+        """
+        return a hashable value equal for commands doing the same thing, made
+        of the class and the values of all the slots
+        """
+        values = [self.__class__]
+        for klass in self.__class__.__mro__:
+            for name in getattr(klass, '__slots__', ()):
+                value = getattr(self, name)
+                if isinstance(value, tuple):
+                    value = tuple([isinstance(x, Command) and x.key() or x for x in value])
+                values.append(value)
+        return tuple(values)
+
+class RconCommand(Command):
+    __slots__ = ('text',)
+
+    def __init__(self, text):
+        self.text = "%s" % text
+
+    def run(self, task):
+        if task.plugin._cvarCache is not None:
+            task.plugin._cvarCache.forget(self.text)
+        if task.plugin._outbox is not None:
+            task.plugin._outbox.send(task, self)
+            return
+        start = time.time()
+        result = task.plugin._link.call(task.plugin.console.write, self.text)
+        task.stats.commandDone(time.time() - start, True)
+        task.plugin.info("rcon command result : %s" % result)
+        self.written(task)
+
+    def written(self, task):
+        """
+        called once the command was written to the game server, after the
+        commands queued before it
+        """
+        if task.plugin._cvarCache is not None:
+            task.plugin._cvarCache.forget(self.text)
+
+    def __repr__(self):
+        return "rcon : %s" % self.text
+
+class CvarCommand(RconCommand):
+    """
+    rcon command setting a cvar, which is not sent again while the game
+    server still has the value it last set
+    """
+    __slots__ = ('name', 'value')
+
+    pattern = re.compile(r'^\s*(?:set[asu]?\s+)(?P<name>[^\s;"]+)\s+(?P<value>[^;]*?)\s*$', re.IGNORECASE | re.DOTALL)
+
+    def __init__(self, text, name, value):
+        RconCommand.__init__(self, text)
+        self.name = name
+        self.value = value
+
+    @classmethod
+    def parse(cls, text):
+        """
+        return a CvarCommand if text sets a cvar, or None
+        """
+        match = cls.pattern.match("%s" % text)
+        if not match:
+            return None
+        return cls(text, match.group('name'), match.group('value'))
+
+    def run(self, task):
+        cache = task.plugin._cvarCache
+        if cache.get(self.name) == self.value:
+            task.plugin.debug("cvar %s already set, not sending it again" % self.name)
+            task.stats.incr('commands_unchanged')
+            return
+        RconCommand.run(self, task)
+
+    def written(self, task):
+        # queued commands are only known to be set once the outbox wrote them
+        task.plugin._cvarCache.set(self.name, self.value)
+
+    def __repr__(self):
+        return "rcon (cvar %s) : %s" % (self.name, self.text)
+
+class FrostbiteCommand(Command):
+    __slots__ = ('cmdlist',)
+
+    def __init__(self, cmdlist):
+        self.cmdlist = tuple(cmdlist)
+
+    def run(self, task):
+        start = time.time()
+        result = task.plugin._link.call(task.plugin.console.write, self.cmdlist)
+        task.stats.commandDone(time.time() - start, True)
+        task.plugin.info("frostbite command result : %s" % result)
+
+    def __repr__(self):
+        return "frostbite : %s" % ' '.join(["%s" % x for x in self.cmdlist])
+
+class FrostbitePipeline(Command):
+    """
+    consecutive frostbite commands of a task. When the game server connection
+    allows it (Frostbite 2 games), all the commands are sent back to back and
+    their responses are then collected by sequence number, instead of waiting
+    for each response before sending the next command
+    """
+    __slots__ = ('commands',)
+
+    def __init__(self, commands):
+        self.commands = tuple(commands)
+
+    def run(self, task):
+        server = getattr(task.plugin.console, '_serverConnection', None)
+        if not task.plugin._pipelineFrostbite or not hasattr(server, 'frostbite_dispatcher'):
+            ok = True
+            for i, cmd in enumerate(self.commands):
+                try:
+                    ok = task.runcommand(cmd) and ok
+                except CircuitOpen, e:
+                    e.remaining = list(self.commands[i:])
+                    raise
+            return ok
+
+        link = task.plugin._link
+        ok = True
+        sent = []
+        unsent = None
+        for i, cmd in enumerate(self.commands):
+            start = time.time()
             try:
-                task = HourlyTask(self, taskconfig)
-                self._tasks.append(task)
-                self.info("hourly task [%s] loaded" % task.name)
+                sequence = link.call(self._send, server, cmd.cmdlist, retries=0)
+                sent.append((cmd, sequence, start))
+            except CircuitOpen, e:
+                unsent = e
+                e.remaining = list(self.commands[i:])
+                break
             except Exception, e:
-                self.error(e)     
-                
-        # load daily tasks from config
-        for taskconfig in self.config.get('daily'):
+                ok = False
+                task.stats.commandDone(time.time() - start, False)
+                task.plugin.error("task %s : %s" % (task.name, e))
+        for cmd, sequence, start in sent:
             try:
-                task = DaylyTask(self, taskconfig)
-                self._tasks.append(task)
-                self.info("daily task [%s] loaded" % task.name)
+                response = link.call(server._wait_for_response, sequence, retries=0)
+                if not response or response[0] != 'OK':
+                    raise Exception("%r failed : %r" % (cmd, response))
+                task.stats.commandDone(time.time() - start, True)
+                task.plugin.info("frostbite command result : %s" % response[1:])
             except Exception, e:
-                self.error(e)
-     
+                ok = False
+                task.stats.commandDone(time.time() - start, False)
+                task.plugin.error("task %s : %s" % (task.name, e))
+        if unsent is not None:
+            raise unsent
+        return ok
+
+    def _send(self, server, words):
+        """
+        send a request without waiting for its response. Its sequence number
+        is registered as pending before sending, or a response arriving before
+        send_command returns would be dropped by the connection
+        """
+        request = frostbiteProtocol.EncodeClientRequest(words)
+        sequence = frostbiteProtocol.DecodePacket(request)[2]
+        server.pending_commands[sequence] = None
+        try:
+            server.frostbite_dispatcher.send(request)
+        except Exception:
+            server.pending_commands.pop(sequence, None)
+            raise
+        return sequence
 
-        self.debug("%d tasks scheduled"% len(self._tasks))
+    def __repr__(self):
+        return "frostbite pipeline : %s" % ' ; '.join([' '.join(["%s" % x for x in cmd.cmdlist]) for cmd in self.commands])
 
-    def onStartup(self):
-        # run RestartTasks
-        for task in self._restart_tasks:
-            try:
-                task.runcommands()
-            except Exception, e:
-                self.error("could not run task %s : %s", (task.name, e))
+class FleetCommand(Command):
+    """
+    rcon and frostbite commands of a task sent to remote game servers of the
+    fleet (see Fleet) instead of the game server B3 is managing. rcon
+    commands go to Quake3 based servers and frostbite ones to Frostbite
+    servers
+    """
+    __slots__ = ('targets', 'rcon', 'frostbite')
 
- 
-    def onEvent(self, event):
-        pass
-        
-    def _convertCronHourToUTC(self, hourcron):
-        """
-        works with "*", "*/4", "5" or 9
-        """
-        if hourcron.strip() == '*': 
-            return hourcron
-        if '/' in hourcron:
-            h,divider = hourcron.split('/')
-            if h.strip() == '*':
-                return hourcron
-            UTChour = (int(h.strip()) - self._tzOffset)%24
-            return "%d/%s" % (UTChour, divider)
+    def __init__(self, targets, rcon, frostbite):
+        self.targets = tuple(targets)
+        self.rcon = tuple(rcon)
+        self.frostbite = tuple(frostbite)
+
+    def commandsFor(self, server):
+        if server.kind == 'frostbite':
+            return self.frostbite
+        return self.rcon
+
+    def run(self, task):
+        fleet = task.plugin._fleet
+        servers = fleet.resolve(self.targets)
+        results = fleet.fanOut(task, servers, self)
+        failed = sorted([name for name, (ok, result) in results.items() if not ok])
+        for name in failed:
+            task.plugin.error("task %s : server %s : %s" % (task.name, name, results[name][1]))
+        task.plugin.info("task %s : commands sent to %s servers, %s failed" % (task.name, len(results), len(failed)))
+        return not failed
+
+    def __repr__(self):
+        return "fleet %s : %s" % (','.join(self.targets), ' ; '.join([
+            "%s" % x for x in self.rcon] + [' '.join(["%s" % x for x in c]) for c in self.frostbite]))
+
+class EnablePluginCommand(Command):
+    __slots__ = ('pluginName',)
+
+    def __init__(self, pluginName):
+        self.pluginName = pluginName
+
+    def run(self, task):
+        target = task.plugin.targetPlugin(self.pluginName)
+        if target.isEnabled():
+            task.plugin.info('Plugin %s is already enabled.' % self.pluginName)
         else:
-            UTChour = (int(hourcron.strip()) - self._tzOffset)%24
-            tz = str(self._tzOffset)
-            if not tz.startswith('-'):
-                tz = '+' + tz
-            self.debug("%s (UTC%s) -> %s UTC" % (hourcron, tz, UTChour))
-            return UTChour
- 
- 
-class TaskConfigError(Exception): pass
+            target.enable()
+            task.plugin.info('Plugin %s is now ON' % self.pluginName)
+        task.stats.commandDone(0, True)
+
+    def __repr__(self):
+        return "enable_plugin : %s" % self.pluginName
+
+class DisablePluginCommand(Command):
+    __slots__ = ('pluginName',)
+
+    def __init__(self, pluginName):
+        self.pluginName = pluginName
+
+    def run(self, task):
+        target = task.plugin.targetPlugin(self.pluginName)
+        if not target.isEnabled():
+            task.plugin.info('Plugin %s is already disabled.' % self.pluginName)
+        else:
+            target.disable()
+            task.plugin.info('Plugin %s is now OFF' % self.pluginName)
+        task.stats.commandDone(0, True)
+
+    def __repr__(self):
+        return "disable_plugin : %s" % self.pluginName
+
 
 class Task(object):
-    config = None
-    plugin = None
-    name = None
+    __slots__ = ('plugin', 'name', 'commands', 'fingerprint', 'overlap', 'stats', 'guard')
     
     def __init__(self, plugin, config):
         self.plugin = plugin
-        self.config = config
+        self.name = None
+        self.commands = ()
+        self.fingerprint = None
+        self.overlap = 'skip'
+        self.guard = None
+        self.stats = TaskStats()
         
         self.name = config.attrib['name']
         if not 'name' in config.attrib:
@@ -172,117 +3704,196 @@ class Task(object):
         else:
             self.name = config.attrib['name']
 
+        if 'overlap' in config.attrib:
+            self.overlap = config.attrib['overlap'].strip().lower()
+            if self.overlap not in ('skip', 'queue', 'concurrent'):
+                raise TaskConfigError('overlap must be one of skip, queue or concurrent for task %s' % self.name)
+
         self.plugin.debug("setting up %s [%s]" % (self.__class__.__name__, self.name) )
 
-        num_commands_found = 0
-        num_commands_found += self._init_rcon_commands()
-        num_commands_found += self._init_enable_plugin_commands()
-        num_commands_found += self._init_disable_plugin_commands()
-        if num_commands_found == 0:
+        self.guard = TaskGuard.fromAttributes(config.attrib)
+        if self.guard:
+            self.plugin.debug("%r" % self.guard)
+
+        commands = []
+        if 'servers' in config.attrib:
+            commands += self._compile_fleet_commands(config)
+        else:
+            commands += self._compile_rcon_commands(config)
+        commands += self._compile_plugin_commands(config, "enable_plugin", EnablePluginCommand)
+        commands += self._compile_plugin_commands(config, "disable_plugin", DisablePluginCommand)
+        if len(commands) == 0:
             raise TaskConfigError('no action found for task %s' % self.name)
+        for cmd in commands:
+            self.plugin.debug("%r" % cmd)
+        # identical commands of different tasks share the same instance
+        self.commands = tuple([self.plugin.sharedCommand(cmd) for cmd in commands])
+
+    def next_fire(self, after):
+        """
+        return the timestamp of the next occurrence of this task strictly after
+        the given timestamp. Tasks are not recurring unless they override this
+        """
+        return None
+
+    def serverCommandCount(self):
+        """
+        number of rcon or frostbite commands sent by one run of this task
+        """
+        count = 0
+        for cmd in self.commands:
+            if isinstance(cmd, FrostbitePipeline):
+                count += len(cmd.commands)
+            elif isinstance(cmd, (RconCommand, FrostbiteCommand)):
+                count += 1
+        return count
+
+    def fire_times(self, start, end):
+        """
+        yield the timestamps of the occurrences of this task after start
+        (excluded) up to end (included)
+        """
+        when = self.next_fire(start)
+        while when is not None and when <= end:
+            yield when
+            when = self.next_fire(when)
+
+    def lastFireTimes(self, start, end, count):
+        """
+        return the last count occurrences after start (excluded) up to end
+        (included). They are searched back from end in growing windows so
+        that long periods of frequent occurrences are not enumerated
+        """
+        first = self.next_fire(start)
+        if first is None or first > end:
+            return []
+        window = 60
+        while True:
+            begin = max(start, end - window)
+            times = collections.deque(self.fire_times(begin, end), count)
+            if len(times) >= count or begin == start:
+                return list(times)
+            window *= 4
 
-    def _init_rcon_commands(self):
+    def _compile_rcon_commands(self, config):
+        commands = []
         if self.plugin.console.gameName in FROSTBITE_GAMES:
-            frostbitecommands = self.config.findall("frostbite") + self.config.findall("bfbc2")
-            for cmd in frostbitecommands:
+            for cmd in config.findall("frostbite") + config.findall("bfbc2"):
                 if not 'command' in cmd.attrib:
                     raise TaskConfigError('cannot find \'command\' attribute for a frostbite element')
-                text = cmd.attrib['command']
+                cmdlist = [cmd.attrib['command']]
                 for arg in cmd.findall('arg'):
-                    text += " %s" % arg.text
-                self.plugin.debug("frostbite : %s" % text)
-                return len(frostbitecommands)
+                    cmdlist.append(arg.text)
+                commands.append(FrostbiteCommand(cmdlist))
+            if len(commands) > 1:
+                commands = [FrostbitePipeline(commands)]
         else:
             ## classical Q3 rcon command
-            rconcommands = self.config.findall("rcon")
-            for cmd in rconcommands:
-                self.plugin.debug("rcon : %s" % cmd.text)
-            return len(rconcommands)
+            idempotent = attributeIsTrue(config.attrib.get('idempotent', 'no'))
+            for cmd in config.findall("rcon"):
+                command = None
+                if attributeIsTrue(cmd.attrib.get('idempotent', idempotent)):
+                    command = CvarCommand.parse(cmd.text)
+                    if command is None:
+                        self.plugin.warning("task %s : %s does not set a cvar, it will always be sent" % (self.name, cmd.text))
+                commands.append(command or RconCommand(cmd.text))
+        return commands
 
-    def _init_enable_plugin_commands(self):
-        commands = self.config.findall("enable_plugin")
-        for cmd in commands:
-            if not 'plugin' in cmd.attrib:
-                raise TaskConfigError('cannot find \'plugin\' attribute for a enable_plugin element')
-            if not self.plugin.console.getPlugin(cmd.attrib['plugin']):
-                raise TaskConfigError('cannot find plugin %s' % cmd.attrib['plugin'])
-            self.plugin.debug("enable_plugin : %s" % cmd.attrib['plugin'])
-        return len(commands)
-
-    def _init_disable_plugin_commands(self):
-        commands = self.config.findall("disable_plugin")
-        for cmd in commands:
+    def _compile_fleet_commands(self, config):
+        targets = [x.strip() for x in config.attrib['servers'].split(',') if x.strip()]
+        if not targets:
+            raise TaskConfigError('servers attribute of task %s is empty' % self.name)
+        if self.guard is not None:
+            raise TaskConfigError('task %s : conditions are not supported for tasks sent to servers' % self.name)
+        self.plugin._fleet.resolve(targets)
+        rcon = [cmd.text for cmd in config.findall("rcon")]
+        frostbite = []
+        for cmd in config.findall("frostbite"):
+            if not 'command' in cmd.attrib:
+                raise TaskConfigError('cannot find \'command\' attribute for a frostbite element')
+            frostbite.append(tuple([cmd.attrib['command']] + [arg.text for arg in cmd.findall('arg')]))
+        if not rcon and not frostbite:
+            return []
+        return [FleetCommand(targets, rcon, frostbite)]
+
+    def _compile_plugin_commands(self, config, tag, commandClass):
+        commands = []
+        for cmd in config.findall(tag):
             if not 'plugin' in cmd.attrib:
-                raise TaskConfigError('cannot find \'plugin\' attribute for a disable_plugin element')
-            if not self.plugin.console.getPlugin(cmd.attrib['plugin']):
-                raise TaskConfigError('cannot find plugin %s' % cmd.attrib['plugin'])
-            self.plugin.debug("disable_plugin : %s" % cmd.attrib['plugin'])
-        return len(commands)
+                raise TaskConfigError('cannot find \'plugin\' attribute for a %s element' % tag)
+            # the plugin is looked up when first needed : it may not be loaded yet
+            commands.append(commandClass(cmd.attrib['plugin'].strip().lower()))
+        return commands
 
-    def runcommands(self):
+    def runcommands(self, commands=None):
+        """
+        run the commands of this task, or the given ones. Return True if they
+        were all sent successfully, False if some failed or if the run was
+        skipped or deferred. If the game server becomes unreachable during
+        the run, the commands not sent yet are deferred
+        """
+        deferred = commands
+        if commands is None:
+            commands = self.commands
+        if not self.plugin.isLeader():
+            self.plugin.debug("not running task %s : another B3 instance holds the scheduler lease" % self.name)
+            self.stats.incr('standby')
+            return False
+        if self.guard is not None:
+            start = time.time()
+            reason = self.guard.check(self.plugin.gameState())
+            if self.plugin._tracer is not None:
+                self.plugin._tracer.phase('conditions', time.time() - start)
+            if reason:
+                self.plugin.info("not running task %s : %s" % (self.name, reason))
+                self.stats.incr('guarded')
+                return False
+        if self.serverCommandCount() and not self.plugin._link.breaker.allow(probe=False):
+            self.plugin.info("game server unreachable, task %s deferred" % self.name)
+            self.stats.incr('deferred')
+            self.plugin.deferTask(self, deferred)
+            return False
         self.plugin.info("running scheduled commands from %s" % self.name)
-        self._run_rcon_commands()
-        self._run_enable_plugin_commands()
-        self._run_disable_plugin_commands()
-
-    def _run_rcon_commands(self):
-        if self.plugin.console.gameName in FROSTBITE_GAMES:
-            # send frostbite commands
-            nodes = self.config.findall("frostbite") + self.config.findall("bfbc2")
-            for frostbitenode in nodes:
-                try:
-                    commandName = frostbitenode.attrib['command']
-                    cmdlist = [commandName]
-                    for arg in frostbitenode.findall('arg'):
-                        cmdlist.append(arg.text)
-                    result = self.plugin.console.write(tuple(cmdlist))
-                    self.plugin.info("frostbite command result : %s" % result)
-                except Exception, e:
-                    self.plugin.error("task %s : %s" % (self.name, e))
-        else:
-            # send rcon commands
-            for cmd in self.config.findall("rcon"):
-                try:
-                    result = self.plugin.console.write("%s" % cmd.text)
-                    self.plugin.info("rcon command result : %s" % result)
-                except Exception, e:
-                    self.plugin.error("task %s : %s" % (self.name, e))
-
-    def _run_enable_plugin_commands(self):
-        for cmd in self.config.findall("enable_plugin"):
+        ok = True
+        for i, cmd in enumerate(commands):
             try:
-                pluginName = cmd.attrib['plugin'].strip().lower()
-                plugin = self.plugin.console.getPlugin(pluginName)
-                if plugin:
-                    if plugin.isEnabled():
-                        self.plugin.info('Plugin %s is already enabled.' % pluginName)
-                    else:
-                        plugin.enable()
-                        self.plugin.info('Plugin %s is now ON' % pluginName)
-                else:
-                    self.plugin.warn('No plugin named %s loaded.' % pluginName)
-            except Exception, e:
-                self.plugin.error("task %s : %s" % (self.name, e))
+                ok = self.runcommand(cmd) and ok
+            except CircuitOpen, e:
+                rest = list(e.remaining or [cmd]) + list(commands[i + 1:])
+                self.plugin.info("game server unreachable, %s commands of task %s deferred" % (len(rest), self.name))
+                self.stats.incr('deferred')
+                self.plugin.deferTask(self, rest)
+                return False
+        return ok
 
-    def _run_disable_plugin_commands(self):
-        for cmd in self.config.findall("disable_plugin"):
-            try:
-                pluginName = cmd.attrib['plugin'].strip().lower()
-                plugin = self.plugin.console.getPlugin(pluginName)
-                if plugin:
-                    if not plugin.isEnabled():
-                        self.plugin.info('Plugin %s is already disabled.' % pluginName)
-                    else:
-                        plugin.disable()
-                        self.plugin.info('Plugin %s is now OFF' % pluginName)
-                else:
-                    self.plugin.warn('No plugin named %s loaded.' % pluginName)
-            except Exception, e:
-                self.plugin.error("task %s : %s" % (self.name, e))
+    def runcommand(self, cmd):
+        """
+        run a command, return False if it failed. Commands reporting their
+        own failures return False from their run method. CircuitOpen is
+        raised when the command was not sent because the game server is
+        unreachable
+        """
+        start = time.time()
+        try:
+            ok = cmd.run(self) is not False
+        except CircuitOpen:
+            raise
+        except Exception, e:
+            ok = False
+            self.stats.commandDone(time.time() - start, False)
+            self.plugin.error("task %s : %s" % (self.name, e))
+        if self.plugin._tracer is not None:
+            self.plugin._tracer.phase(("%r" % cmd)[:60], time.time() - start)
+        return ok
 
 class RestartTask(Task):
+    __slots__ = ('delay',)
+
     def __init__(self, plugin, config):
         Task.__init__(self, plugin, config)
+        self.delay = None
+        if 'delay' in config.attrib:
+            self.delay = b3.functions.time2minutes(config.attrib['delay']) * 60
         self.schedule()
 
     def schedule(self):
@@ -296,44 +3907,86 @@ class RestartTask(Task):
         remove this task from schedule
         """
         self.plugin._restart_tasks.remove(self)
+        self.plugin._scheduler.remove(self)
 
-    def runcommands(self):
-        if 'delay' in self.config.attrib:
-            delay_minutes = b3.functions.time2minutes(self.config.attrib['delay'])
-            threading.Timer(delay_minutes * 60, Task.runcommands, [self]).start()
+    def trigger(self):
+        """
+        run this task now or, if it has a delay, schedule a single run once the
+        delay is elapsed
+        """
+        if self.delay is not None:
+            scheduler = self.plugin._scheduler
+            scheduler.addAt(self, scheduler.clock() + self.delay)
         else:
-            Task.runcommands(self)
+            self.plugin._executor.submit(self)
 
 
 class CronTask(Task):
-    cronTab = None
-    seconds = None
-    minutes = None
-    hour = None
-    day = None
-    month = None
-    dow = None
+    __slots__ = ('cron', 'seconds', 'minutes', 'hour', 'day', 'month', 'dow', 'jitter', 'offset', 'misfire')
 
     def __init__(self, plugin, config):
         Task.__init__(self, plugin, config)
+        self.cron = None
+        self.jitter = None
+        self.offset = 0
+        self.misfire = None
+        if 'jitter' in config.attrib:
+            self.jitter = int(b3.functions.time2minutes(config.attrib['jitter']) * 60)
+        if 'misfire' in config.attrib:
+            self.misfire = config.attrib['misfire'].strip().lower()
+            if self.misfire not in MISFIRE_POLICIES:
+                raise TaskConfigError('misfire must be one of %s for task %s' % (', '.join(MISFIRE_POLICIES), self.name))
+        self._getScheduledTime(config.attrib)
         self.schedule()
         
     def schedule(self):
         """
         schedule this task
         """
-        self._getScheduledTime(self.config.attrib)
-        self.cronTab = b3.cron.PluginCronTab(self.plugin, self.runcommands, 
-            self.seconds, self.minutes, self.plugin._convertCronHourToUTC(self.hour), self.day, self.month, self.dow)
-        self.plugin.console.cron + self.cronTab
+        self.cron = CronExpression.compile(self.seconds, self.minutes, self.hour, self.day, self.month, self.dow)
+        self.offset = self._jitterOffset()
+        if self.offset:
+            self.plugin.debug("task %s runs %ss after its scheduled times (jitter)" % (self.name, self.offset))
+        self.plugin._scheduler.add(self)
         
     def cancel(self):
         """
         remove this task from schedule
         """
-        if self.cronTab:
+        if self.cron:
             self.plugin.info("canceling scheduled task [%s]" % self.name)
-            self.plugin.console.cron - self.cronTab
+            self.plugin._scheduler.remove(self)
+
+    def next_fire(self, after):
+        """
+        return the timestamp of the first occurrence of this task strictly
+        after the given timestamp
+        """
+        when = self.cron.next_fire(after - self.offset, self.plugin._zone)
+        if when is None:
+            return None
+        return when + self.offset
+
+    def fire_times(self, start, end):
+        for when in self.cron.fire_times(start - self.offset, end - self.offset, self.plugin._zone):
+            yield when + self.offset
+
+    def journalKey(self):
+        return u'%s:%s' % (self.__class__.__name__, self.name)
+
+    def _jitterOffset(self):
+        """
+        return a delay within the jitter window of this task (or the global
+        one) derived from the task name and the game server, so tasks sharing
+        a schedule are spread over the window but each one keeps stable times
+        """
+        window = self.jitter
+        if window is None:
+            window = self.plugin._jitter
+        if not window or window <= 0:
+            return 0
+        key = (u'%s|%s' % (self.name, self.plugin.serverKey())).encode('utf-8')
+        return int(hashlib.md5(key).hexdigest()[:8], 16) % window
 
     def _getScheduledTime(self, attrib):
 
@@ -369,7 +4022,61 @@ class CronTask(Task):
         
         self.plugin.info('%s %s %s\t%s %s %s' % (self.seconds, self.minutes, self.hour, self.day, self.month, self.dow))
  
+class EventTask(Task):
+    """
+    Task run when B3 receives one of the events listed in its type attribute.
+    With a debounce delay, it runs once events stopped coming for that long.
+    With a cooldown, events received less than cooldown after its last run
+    are ignored
+    """
+    __slots__ = ('eventIds', 'debounce', 'cooldown', 'lastRun')
+
+    def __init__(self, plugin, config):
+        Task.__init__(self, plugin, config)
+        self.debounce = 0
+        self.cooldown = 0
+        self.lastRun = None
+        if not config.attrib.get('type', '').strip():
+            raise TaskConfigError("cannot find 'type' attribute for task %s" % self.name)
+        eventIds = []
+        for name in config.attrib['type'].split(','):
+            eventId = self.plugin.console.getEventID(name.strip().upper())
+            if eventId is None:
+                raise TaskConfigError('unknown event %s for task %s' % (name.strip(), self.name))
+            eventIds.append(eventId)
+        self.eventIds = tuple(eventIds)
+        if 'debounce' in config.attrib:
+            self.debounce = b3.functions.time2minutes(config.attrib['debounce']) * 60
+        if 'cooldown' in config.attrib:
+            self.cooldown = b3.functions.time2minutes(config.attrib['cooldown']) * 60
+
+    def trigger(self, event):
+        scheduler = self.plugin._scheduler
+        now = scheduler.clock()
+        if self.cooldown and self.lastRun is not None and now - self.lastRun < self.cooldown:
+            self.plugin.verbose("task %s is cooling down, ignoring event" % self.name)
+            self.stats.incr('skipped')
+            return
+        if self.debounce:
+            scheduler.remove(self)
+            scheduler.addAt(self, now + self.debounce)
+        else:
+            self.plugin._executor.submit(self, now)
+
+    def runcommands(self, commands=None):
+        self.lastRun = self.plugin._scheduler.clock()
+        return Task.runcommands(self, commands)
+
+    def cancel(self):
+        """
+        forget a pending debounced run
+        """
+        self.plugin._scheduler.remove(self)
+
+
 class HourlyTask(CronTask):
+    __slots__ = ()
+
     def _getScheduledTime(self, attrib):
         self.seconds = 0
 
@@ -385,6 +4092,8 @@ class HourlyTask(CronTask):
         self.dow = '*'
         
 class DaylyTask(CronTask):
+    __slots__ = ()
+
     def _getScheduledTime(self, attrib):
         self.seconds = 0
 
@@ -403,6 +4112,269 @@ class DaylyTask(CronTask):
         self.day = '*'
         self.month = '*'
         self.dow = '*'
+
+
+class CsvCalendarSource(object):
+    """
+    Rows of a CSV file sorted by time : 'time,name,command[,command...]'.
+    The time is a unix timestamp or a 'YYYY-MM-DD HH:MM[:SS]' wall clock
+    time in the plugin timezone. Lines which do not start with a time (ie: a
+    header) are ignored. The first upcoming row is found by a binary search
+    on the file offsets, then rows are read in order from the last offset
+    read, reopening the file each time
+    """
+    timePattern = re.compile(r'^(\d{4})-(\d{1,2})-(\d{1,2})[ T](\d{1,2}):(\d{2})(?::(\d{2}))?$')
+
+    def __init__(self, path, zone):
+        self.path = path
+        self.zone = zone
+        self.offset = 0
+
+    def seek(self, after):
+        """
+        position the reader on the first row with a time after timestamp
+        after
+        """
+        f = open(self.path, 'rb')
+        try:
+            f.seek(0, 2)
+            lo, hi = 0, f.tell()
+            while lo < hi:
+                mid = (lo + hi) // 2
+                row = self._rowAt(f, mid)
+                if row is None or row[0] > after:
+                    hi = mid
+                else:
+                    lo = mid + 1
+            self._rowAt(f, lo)
+            self.offset = self._lineStart
+        finally:
+            f.close()
+
+    def next(self, count):
+        """
+        return the next count rows as (when, name, commands) tuples
+        """
+        rows = []
+        f = open(self.path, 'rb')
+        try:
+            f.seek(self.offset)
+            while len(rows) < count:
+                line = f.readline()
+                if not line:
+                    break
+                row = self._parse(line)
+                if row is not None:
+                    rows.append(row)
+            self.offset = f.tell()
+        finally:
+            f.close()
+        return rows
+
+    def _rowAt(self, f, offset):
+        """
+        return the first row starting at or after offset, or None at the end
+        of the file. Its offset is kept in _lineStart
+        """
+        if offset > 0:
+            f.seek(offset - 1)
+            f.readline()
+        else:
+            f.seek(0)
+        while True:
+            self._lineStart = f.tell()
+            line = f.readline()
+            if not line:
+                return None
+            row = self._parse(line)
+            if row is not None:
+                return row
+
+    def _parse(self, line):
+        try:
+            cells = csv.reader([line]).next()
+        except (csv.Error, StopIteration):
+            return None
+        if len(cells) < 3:
+            return None
+        when = self._time(cells[0].strip())
+        if when is None:
+            return None
+        return when, cells[1].strip(), [x for x in cells[2:] if x.strip()]
+
+    def _time(self, text):
+        try:
+            return float(text)
+        except ValueError:
+            pass
+        match = self.timePattern.match(text)
+        if not match:
+            return None
+        fields = [int(x or 0) for x in match.groups()]
+        return self.zone.timestamps(fields)[0]
+
+
+class SqliteCalendarSource(object):
+    """
+    Rows of a SQLite table with time (unix timestamp), name and command
+    columns, one command per row. Rows are read in (time, rowid) order from
+    the last one read, using an index on time
+    """
+
+    def __init__(self, path, table):
+        if sqlite3 is None:
+            raise TaskConfigError("sqlite calendars require the sqlite3 python module")
+        if not re.match(r'^\w+$', table):
+            raise TaskConfigError("invalid calendar table name %s" % table)
+        self.path = path
+        self.table = table
+        self.position = (0, 0)
+        db = sqlite3.connect(self.path)
+        try:
+            db.execute("CREATE INDEX IF NOT EXISTS %s_time ON %s (time)" % (table, table))
+            db.commit()
+        finally:
+            db.close()
+
+    def seek(self, after):
+        self.position = (after, None)
+
+    def next(self, count):
+        when, rowid = self.position
+        db = sqlite3.connect(self.path)
+        try:
+            if rowid is None:
+                cursor = db.execute("SELECT rowid, time, name, command FROM %s WHERE time > ? ORDER BY time, rowid LIMIT ?"
+                    % self.table, (when, count))
+            else:
+                cursor = db.execute("SELECT rowid, time, name, command FROM %s WHERE time > ? OR (time = ? AND rowid > ?) "
+                    "ORDER BY time, rowid LIMIT ?" % self.table, (when, when, rowid, count))
+            rows = cursor.fetchall()
+        finally:
+            db.close()
+        if rows:
+            self.position = (rows[-1][1], rows[-1][0])
+        return [(float(t), "%s" % name, [command]) for rowid, t, name, command in rows]
+
+
+class Calendar(object):
+    """
+    One-shot tasks read from a calendar file (see CsvCalendarSource and
+    SqliteCalendarSource). Only the next window events are loaded, as
+    CalendarEvent runs in the scheduler. The calendar itself is scheduled
+    at the time of the middle of that window to load the next events, so
+    memory does not depend on the size of the file. Events which were due
+    while B3 was stopped are skipped
+    """
+    defaultWindow = 100
+    overlap = 'skip'
+    ## delay before loading the next events again when a load was dropped
+    retryDelay = 60
+
+    def __init__(self, plugin, name, source, window=defaultWindow):
+        self.plugin = plugin
+        self.name = name
+        self.source = source
+        self.window = window
+        # stats of the loads, and of the events
+        self.stats = TaskStats()
+        self.eventStats = TaskStats()
+        self.events = []
+        self.exhausted = False
+
+    @classmethod
+    def fromConfig(cls, plugin, node):
+        attrib = node.attrib
+        for name in ('name', 'file'):
+            if not attrib.get(name, '').strip():
+                raise TaskConfigError("cannot find '%s' attribute for a calendar element" % name)
+        path = b3.getAbsolutePath(attrib['file'].strip())
+        kind = attrib.get('format', '').strip().lower()
+        if not kind:
+            kind = os.path.splitext(path)[1].lower() in ('.db', '.sqlite', '.sqlite3') and 'sqlite' or 'csv'
+        if kind == 'sqlite':
+            source = SqliteCalendarSource(path, attrib.get('table', 'events').strip())
+        elif kind == 'csv':
+            if not os.path.isfile(path):
+                raise TaskConfigError("cannot find calendar file %s" % path)
+            source = CsvCalendarSource(path, plugin._zone)
+        else:
+            raise TaskConfigError("calendar format must be csv or sqlite")
+        try:
+            window = max(int(attrib.get('window', cls.defaultWindow)), 2)
+        except ValueError:
+            raise TaskConfigError("invalid window for calendar %s" % attrib['name'])
+        return cls(plugin, attrib['name'].strip(), source, window)
+
+    def start(self):
+        self.source.seek(self.plugin._scheduler.clock())
+        self.load()
+
+    def next_fire(self, after):
+        return None
+
+    def runcommands(self):
+        self.load()
+
+    def load(self):
+        """
+        schedule the next window events, and the next load
+        """
+        scheduler = self.plugin._scheduler
+        now = scheduler.clock()
+        self.events = [x for x in self.events if x.when > now]
+        rows = self.source.next(self.window)
+        for when, name, texts in rows:
+            if when <= now:
+                # the load was delayed (see SchedulerPlugin.runDropped)
+                self.plugin.debug("calendar %s : skipping past event %s" % (self.name, name))
+                continue
+            try:
+                event = CalendarEvent(self, when, name, texts)
+            except TaskConfigError, e:
+                self.plugin.error("calendar %s : %s" % (self.name, e))
+                continue
+            self.events.append(event)
+            scheduler.addAt(event, when)
+        self.exhausted = len(rows) < self.window
+        if not self.exhausted:
+            scheduler.addAt(self, rows[len(rows) // 2][0])
+        self.plugin.debug("calendar %s : %s events loaded" % (self.name, len(rows)))
+
+    def cancel(self):
+        scheduler = self.plugin._scheduler
+        scheduler.remove(self)
+        for event in self.events:
+            scheduler.remove(event)
+        self.events = []
+
+
+class CalendarEvent(Task):
+    """
+    a single run of commands read from a calendar
+    """
+    __slots__ = ('when',)
+
+    def __init__(self, owner, when, name, texts):
+        self.plugin = owner.plugin
+        self.name = name or owner.name
+        self.fingerprint = None
+        self.overlap = 'concurrent'
+        self.guard = None
+        self.stats = owner.eventStats
+        self.when = when
+        if self.plugin.console.gameName in FROSTBITE_GAMES:
+            commands = [FrostbiteCommand(shlex.split(x.encode('utf-8') if isinstance(x, unicode) else x)) for x in texts]
+            if len(commands) > 1:
+                commands = [FrostbitePipeline(commands)]
+        else:
+            commands = [RconCommand(x) for x in texts]
+        if not commands:
+            raise TaskConfigError('no command for event %s' % self.name)
+        self.commands = tuple(commands)
+
+    def next_fire(self, after):
+        return None
         
         
 if __name__ == '__main__':
@@ -597,6 +4569,535 @@ if __name__ == '__main__':
         p2.onLoadConfig()
         p2.onStartup()
 
+    def utc(*args):
+        return calendar.timegm(datetime.datetime(*args).timetuple())
+
+    def occurrences(cron, start, end, zone=None):
+        """occurrences of cron after start up to end, calling next_fire repeatedly"""
+        found = []
+        when = cron.next_fire(start, zone)
+        while when is not None and when <= end:
+            found.append(when)
+            when = cron.next_fire(when, zone)
+        return found
+
+    def test_cron_expression():
+        start = utc(2013, 1, 1) # a tuesday
+
+        # lists, ranges and steps
+        cron = CronExpression(seconds=0, minutes='5,10-12,*/20,45/5', hour='8-18/5')
+        expected = [start + h * 3600 + m * 60 for h in (8, 13, 18) for m in (0, 5, 10, 11, 12, 20, 40, 45, 50, 55)]
+        assert occurrences(cron, start - 1, start + 86399) == expected
+        assert cron.next_fire(start + 8 * 3600) == start + 8 * 3600 + 300
+        assert cron.next_fire(start + 18 * 3600 + 55 * 60) == start + 86400 + 8 * 3600
+
+        # month and day of week names, days of week follow B3 : 0 is monday
+        cron = CronExpression(seconds=30, minutes=15, hour=6, month='feb-mar,dec', dow='sat,sun')
+        assert cron.next_fire(start) == utc(2013, 2, 2, 6, 15, 30)
+        assert cron.next_fire(utc(2013, 3, 31, 6, 15, 30)) == utc(2013, 12, 1, 6, 15, 30)
+        assert CronExpression(minutes=0, hour=0, dow=0).next_fire(start) == utc(2013, 1, 7)
+        assert CronExpression(minutes=0, hour=0, dow='6').next_fire(start) == utc(2013, 1, 6)
+
+        # day of month and day of week must both match
+        assert CronExpression(minutes=0, hour=0, day=13, dow='fri').next_fire(start) == utc(2013, 9, 13)
+
+        # leap days and days missing from some months
+        assert CronExpression(minutes=0, hour=12, day=29, month='feb').next_fire(start) == utc(2016, 2, 29, 12)
+        assert CronExpression(minutes=0, hour=0, day=31).next_fire(utc(2013, 4, 1)) == utc(2013, 5, 31)
+
+        # expressions which never match
+        cron = CronExpression(minutes=0, hour=0, day=31, month='feb')
+        assert cron.next_fire(start) is None
+        assert list(cron.fire_times(start, start + 366 * 86400)) == []
+        assert CronExpression(minutes=0, hour=0, day=30, month=2, dow='*').next_fire(start) is None
+
+        # invalid fields
+        for fields in ({'minutes': '60'}, {'hour': '5-2'}, {'minutes': '*/0'}, {'month': 'foo'}, {'dow': '7'}, {'day': '0'}):
+            try:
+                CronExpression(**fields)
+            except ValueError:
+                pass
+            else:
+                raise AssertionError("%r should not be accepted" % fields)
+
+        # fire_times yields what calling next_fire repeatedly does
+        end = start + 366 * 86400
+        for fields in ({'minutes': '*/15'}, {'seconds': '*/20', 'minutes': '0-2', 'hour': '3'},
+                {'minutes': 30, 'hour': '1-3', 'day': '25-31', 'month': 'mar,oct', 'dow': 'sun'}):
+            cron = CronExpression(**fields)
+            assert list(cron.fire_times(start, end)) == occurrences(cron, start, end), fields
+            for zone in (getTimezone('local'), getTimezone('CST')):
+                assert list(cron.fire_times(start, end, zone)) == occurrences(cron, start, end, zone), (fields, zone)
+
+        # compiled expressions are shared
+        assert CronExpression.compile(0, '*/5') is CronExpression.compile('0', ' */5 ')
+
+    def test_timezones():
+        # fixed offsets, including half hours, with hour ranges and lists
+        cst = getTimezone('CST')
+        assert cst.fixed and cst.utcoffset(utc(2013, 7, 1)) == -6 * 3600
+        cron = CronExpression(minutes=0, hour='22-23,1')
+        assert occurrences(cron, utc(2013, 1, 1), utc(2013, 1, 2), cst) == [utc(2013, 1, 1, 4), utc(2013, 1, 1, 5), utc(2013, 1, 1, 7)]
+        acst = getTimezone('ACST')
+        assert acst.utcoffset(utc(2013, 1, 1)) == 9 * 3600 + 1800
+        cron = CronExpression(minutes='0,45', hour='0,8-9')
+        assert occurrences(cron, utc(2013, 1, 1), utc(2013, 1, 2), acst) == [utc(2013, 1, 1, hour, minute)
+            for hour, minute in ((0, 15), (14, 30), (15, 15), (22, 30), (23, 15), (23, 30))]
+        assert acst.localtime(utc(2013, 1, 1, 14, 30))[:5] == (2013, 1, 2, 0, 0)
+
+        zones = []
+        previous = os.environ.get('TZ')
+        os.environ['TZ'] = 'Europe/Paris'
+        time.tzset()
+        try:
+            zones.append(getTimezone('local'))
+            if pytz:
+                zones.append(getTimezone('Europe/Paris'))
+            for zone in zones:
+                assert not zone.fixed
+                assert zone.utcoffset(utc(2013, 1, 1)) == 3600 and zone.utcoffset(utc(2013, 7, 1)) == 7200, zone
+
+                # 2013-03-31 : clocks go from 02:00 CET to 03:00 CEST at 01:00 UTC
+                day = utc(2013, 3, 30, 12)
+                cron = CronExpression(minutes=30, hour=2)
+                assert occurrences(cron, day, day + 2 * 86400, zone) == [
+                    utc(2013, 3, 31, 1, 30), # 02:30 does not exist, fired at 03:30 after the change
+                    utc(2013, 4, 1, 0, 30)], zone
+                cron = CronExpression(minutes=0, hour='1-3')
+                assert occurrences(cron, day, day + 86400, zone) == [utc(2013, 3, 31, 0), utc(2013, 3, 31, 1)], zone
+                cron = CronExpression(minutes=30)
+                assert occurrences(cron, utc(2013, 3, 30, 23, 59), utc(2013, 3, 31, 2), zone) == [
+                    utc(2013, 3, 31, 0, 30), utc(2013, 3, 31, 1, 30)], zone
+
+                # 2013-10-27 : clocks go from 03:00 CEST back to 02:00 CET at 01:00 UTC
+                day = utc(2013, 10, 26, 12)
+                cron = CronExpression(minutes=30, hour=2)
+                assert occurrences(cron, day, day + 2 * 86400, zone) == [
+                    utc(2013, 10, 27, 0, 30), # 02:30 happens twice, fired once
+                    utc(2013, 10, 28, 1, 30)], zone
+                cron = CronExpression(minutes=0, hour='1-3')
+                assert occurrences(cron, day, day + 86400, zone) == [
+                    utc(2013, 10, 26, 23), utc(2013, 10, 27, 0), utc(2013, 10, 27, 2)], zone
+                # unless the expression matches every hour
+                cron = CronExpression(minutes=30)
+                assert occurrences(cron, utc(2013, 10, 26, 23, 59), utc(2013, 10, 27, 2), zone) == [
+                    utc(2013, 10, 27, 0, 30), utc(2013, 10, 27, 1, 30)], zone
+
+                for cron in (CronExpression(minutes=30, hour=2), CronExpression(minutes='*/20', hour='1-3')):
+                    start, end = utc(2013, 1, 1), utc(2014, 1, 1)
+                    assert list(cron.fire_times(start, end, zone)) == occurrences(cron, start, end, zone), (cron, zone)
+        finally:
+            if previous is None:
+                del os.environ['TZ']
+            else:
+                os.environ['TZ'] = previous
+            time.tzset()
+
+
+    ## checks, exiting with status 1 on failure :
+    ## python scheduler.py test
+    ## benchmarks :
+    ## python scheduler.py bench [--game name] [--max-<metric> value ...] [--baseline file [--tolerance 0.2]] [number of tasks ...]
+    ## metrics are load_us, rss_kb, tick_us, drift_p99, reload_s, reload_changed_s
+    ## and rcon_drift_p99. A missing baseline file is created from the results
+    ## load simulation of a config file :
+    ## python scheduler.py simulate [--game name] <scheduler.xml> [days]
+    ## everything runs on a virtual clock, tasks are run inline by the
+    ## scheduler and the fake console records commands instead of printing them
+    import sys, random, logging
+
+    class VirtualClock(object):
+        def __init__(self, now):
+            self.now = now
+        def __call__(self):
+            return self.now
+
+    class RecordingWrite(object):
+        """fake console write recording (virtual time, command). Each command
+        takes rtt virtual seconds"""
+        def __init__(self, clock, rtt=0):
+            self.clock = clock
+            self.rtt = rtt
+            self.sent = []
+        def __call__(self, text):
+            self.clock.now += self.rtt
+            self.sent.append((self.clock.now, text))
+            return 'ok'
+
+    def generate_config(n, seed=42, changed=0):
+        """xml config of n tasks with a deterministic mix of cron, hourly and
+        daily schedules. The first changed tasks get a different command"""
+        rnd = random.Random(seed)
+        xml = ['<configuration plugin="scheduler">',
+            '<settings name="settings"><set name="timezone">UTC</set><set name="workers">0</set>'
+            '<set name="command_timeout">0</set></settings>']
+        for i in range(n):
+            text = 'say "task %s%s"' % (i, i < changed and ' changed' or '')
+            kind = rnd.randint(0, 9)
+            if kind < 6:
+                xml.append('<cron name="c%s" seconds="%s" minutes="*/%s"><rcon>%s</rcon></cron>' % (i,
+                    rnd.randint(0, 59), rnd.choice((1, 2, 5, 10, 15, 30)), text))
+            elif kind < 9:
+                xml.append('<hourly name="h%s" minutes="%s"><rcon>%s</rcon></hourly>' % (i, rnd.randint(0, 59), text))
+            else:
+                xml.append('<daily name="d%s" hour="%s" minutes="%s"><rcon>%s</rcon></daily>' % (i,
+                    rnd.randint(0, 23), rnd.randint(0, 59), text))
+        xml.append('</configuration>')
+        conf = XmlConfigParser()
+        conf.setXml(''.join(xml))
+        return conf
+
+    def max_rss():
+        try:
+            import resource
+        except ImportError:
+            return None
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    def guess_game(conf):
+        """bfbc2 or bf3 if tasks of the config send frostbite commands,
+        urt41 otherwise"""
+        for tag in ('restart', 'cron', 'hourly', 'daily', 'on_event'):
+            for taskconfig in conf.get(tag):
+                if taskconfig.findall('bfbc2'):
+                    return 'bfbc2'
+                if taskconfig.findall('frostbite'):
+                    return 'bf3'
+        return 'urt41'
+
+    def new_plugin(conf, clock, game=None):
+        fakeConsole.gameName = game or guess_game(conf)
+        p = SchedulerPlugin(fakeConsole, conf)
+        p._executor = TaskExecutor(p, 0, clock=clock)
+        p._scheduler = TaskScheduler(p, p._executor, clock)
+        return p
+
+    def run_virtual(p, clock, seconds, step=1):
+        """run the scheduler for seconds of virtual time, return the cpu
+        time spent. Slow commands move the clock forward too"""
+        end = clock.now + seconds
+        tick = clock.now
+        cpu = time.clock()
+        while tick < end and clock.now < end:
+            tick += step
+            clock.now = max(clock.now, tick)
+            p._scheduler.runPending(clock.now)
+        return time.clock() - cpu
+
+    def lateness(p):
+        h = Histogram()
+        for t in p._tasks:
+            for bound, n in zip(t.stats.lateness.bounds + (None,), t.stats.lateness.counts):
+                h.counts[bisect.bisect_left(h.bounds, bound or h.bounds[-1] + 1)] += n
+            h.count += t.stats.lateness.count
+            h.total += t.stats.lateness.total
+            h.max = max(h.max, t.stats.lateness.max)
+        return h
+
+    def bench(n, game=None):
+        """print and return the metrics of n generated tasks"""
+        start = 1356998400.0 # 2013-01-01 00:00 UTC
+        clock = VirtualClock(start)
+        recorder = RecordingWrite(clock)
+        FakeConsole.write = recorder
+
+        rss = max_rss()
+        cpu = time.clock()
+        conf = generate_config(n)
+        p = new_plugin(conf, clock, game)
+        p.onLoadConfig()
+        loadTime = time.clock() - cpu
+        rss = rss and max_rss() - rss
+        metrics = {'load_us': loadTime * 1e6 / n, 'rss_kb': rss}
+        print "%6s tasks : load %8.3fs (%6.1fus/task), peak rss +%s kB" % (n, loadTime, loadTime * 1e6 / n, rss)
+
+        seconds = 3600
+        cpu = run_virtual(p, clock, seconds)
+        h = lateness(p)
+        print "%6s tasks : tick %8.1fus, %s runs in %ss, %.0f runs/s of cpu, drift p50 %.3fs p99 %.3fs max %.3fs" % (
+            n, cpu * 1e6 / seconds, h.count, seconds, h.count / max(cpu, 1e-9), h.percentile(50), h.percentile(99), h.max)
+        metrics.update({'tick_us': cpu * 1e6 / seconds, 'drift_p99': h.percentile(99)})
+
+        cpu = time.clock()
+        p.config = generate_config(n)
+        p.onLoadConfig()
+        same = time.clock() - cpu
+        cpu = time.clock()
+        p.config = generate_config(n, changed=n // 10)
+        p.onLoadConfig()
+        changed = time.clock() - cpu
+        print "%6s tasks : reload %8.3fs unchanged, %8.3fs with 10%% modified" % (n, same, changed)
+        metrics.update({'reload_s': same, 'reload_changed_s': changed})
+
+        # slow rcon endpoint : each command takes 50ms of virtual time
+        clock = VirtualClock(start)
+        recorder = RecordingWrite(clock, rtt=0.05)
+        FakeConsole.write = recorder
+        p = new_plugin(generate_config(n), clock, game)
+        p.onLoadConfig()
+        run_virtual(p, clock, seconds)
+        h = lateness(p)
+        elapsed = max(clock.now - start, 1)
+        print "%6s tasks : 50ms rcon, %s commands in %.0fs (%.1f/s), drift p50 %.3fs p99 %.3fs max %.3fs" % (
+            n, len(recorder.sent), elapsed, len(recorder.sent) / elapsed, h.percentile(50), h.percentile(99), h.max)
+        metrics['rcon_drift_p99'] = h.percentile(99)
+        return metrics
+
+    ## differences with the baseline smaller than that are measurement noise.
+    ## drifts are measured on the virtual clock and do not vary between runs
+    benchNoise = {'load_us': 20, 'rss_kb': 1024, 'tick_us': 5, 'reload_s': 0.005, 'reload_changed_s': 0.005}
+
+    def check_bench(results, limits, baseline, tolerance):
+        """return the bench metrics above their --max-<metric> limit, or
+        above their value in baseline by more than tolerance (0.2 is 20%)"""
+        failures = []
+        for n, metrics in sorted(results.items()):
+            for name, value in sorted(metrics.items()):
+                if value is None:
+                    continue
+                if name in limits and value > limits[name]:
+                    failures.append("%6s tasks : %s %.3f over the limit of %.3f" % (n, name, value, limits[name]))
+                base = baseline.get(str(n), {}).get(name)
+                if base is not None and value > base * (1 + tolerance) and value - base > benchNoise.get(name, 0):
+                    failures.append("%6s tasks : %s %.3f over the baseline %.3f + %d%%" % (n, name, value, base, tolerance * 100))
+        return failures
+
+    def simulate(path, days=30, game=None):
+        """print the load a config would put on the game server over the
+        next days"""
+        conf = XmlConfigParser()
+        conf.load(path)
+        clock = VirtualClock(time.time())
+        p = new_plugin(conf, clock, game)
+        p.onLoadConfig()
+        zone = p._zone
+        start = clock.now
+        end = start + days * 86400
+        cpu = time.clock()
+        report = ScheduleSimulator(p._tasks).run(start, end)
+        cpu = time.clock() - cpu
+        def fmt(stamp):
+            return time.strftime('%Y-%m-%d %H:%M:%S', zone.localtime(stamp))
+        print "%s tasks, %s runs and %s server commands over %s days (%.1f commands/day, simulated in %.2fs)" % (
+            report['tasks'], report['runs'], report['commands'], days, report['commands'] / float(days), cpu)
+        print "at most %s server commands in the same second" % report['peak_commands_per_second']
+        print "runs per minute :"
+        for runs, minutes in sorted(report['runs_per_minute'].items()):
+            print "  %4s runs : %s minutes" % (runs, minutes)
+        print "busiest minutes :"
+        for minute, runs in report['busiest_minutes']:
+            print "  %s : %s runs" % (fmt(minute)[:-3], runs)
+        print "tasks firing in the same second :"
+        for second, names in report['collisions']:
+            print "  %s : %s" % (fmt(second), ', '.join(names))
+
+    class StandInQ3Server(object):
+        """local UDP game server answering rcon commands after delay
+        seconds"""
+        def __init__(self, password='secret', delay=0):
+            self.password = password
+            self.delay = delay
+            self.received = []
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.socket.bind(('127.0.0.1', 0))
+            self.port = self.socket.getsockname()[1]
+            thread = threading.Thread(target=self._serve)
+            thread.setDaemon(True)
+            thread.start()
+        def _serve(self):
+            while True:
+                data, address = self.socket.recvfrom(65536)
+                threading.Thread(target=self._answer, args=(data, address)).start()
+        def _answer(self, data, address):
+            match = re.match(r'^\377{4}rcon "(.*?)" (.*)\n$', data, re.DOTALL)
+            time.sleep(self.delay)
+            if match.group(1) != self.password:
+                self.socket.sendto('\377\377\377\377print\nBad rconpassword.\n', address)
+                return
+            self.received.append(match.group(2))
+            self.socket.sendto('\377\377\377\377print\nok %s\n' % match.group(2), address)
+
+    class StandInFrostbiteServer(object):
+        """local TCP Frostbite server accepting hashed logins and answering
+        OK to commands after delay seconds"""
+        def __init__(self, password='secret', delay=0):
+            self.password = password
+            self.delay = delay
+            self.received = []
+            self.connections = 0
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.socket.bind(('127.0.0.1', 0))
+            self.socket.listen(5)
+            self.port = self.socket.getsockname()[1]
+            thread = threading.Thread(target=self._serve)
+            thread.setDaemon(True)
+            thread.start()
+        def _serve(self):
+            while True:
+                client, address = self.socket.accept()
+                self.connections += 1
+                thread = threading.Thread(target=self._session, args=(client,))
+                thread.setDaemon(True)
+                thread.start()
+        def _session(self, client):
+            salt = os.urandom(16)
+            logged = False
+            buffer = ''
+            try:
+                while True:
+                    packet, buffer = frostbiteProtocol.receivePacket(client, buffer)
+                    fromServer, isResponse, sequence, words = frostbiteProtocol.DecodePacket(packet)
+                    time.sleep(self.delay)
+                    if words == ['login.hashed']:
+                        answer = ['OK', salt.encode('hex').upper()]
+                    elif words[0] == 'login.hashed':
+                        logged = words[1] == frostbiteProtocol.generatePasswordHash(salt, self.password).encode('hex').upper()
+                        answer = [logged and 'OK' or 'InvalidPasswordHash']
+                    elif not logged:
+                        answer = ['LogInRequired']
+                    else:
+                        self.received.append(words)
+                        answer = ['OK']
+                    client.sendall(frostbiteProtocol.EncodePacket(True, True, sequence, answer))
+            except socket.error:
+                client.close()
+
+    def fleet(n, delay=0.05):
+        """send a task to n rcon and n frostbite stand-in servers, plus one
+        with a wrong password and one which is down. Return the list of
+        failed checks"""
+        q3 = [StandInQ3Server(delay=delay) for i in range(n)]
+        fb = [StandInFrostbiteServer(delay=delay) for i in range(n)]
+        wrong = StandInQ3Server(password='other')
+        down = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        down.bind(('127.0.0.1', 0))
+        xml = ['<configuration plugin="scheduler">',
+            '<settings name="settings"><set name="timezone">UTC</set><set name="fleet_connections">%s</set>'
+            '<set name="command_timeout">1</set><set name="command_retries">0</set><set name="circuit_threshold">2</set>'
+            '</settings>' % (n * 2)]
+        for i, server in enumerate(q3):
+            xml.append('<server name="q%s" group="q3,all" game="urt42" host="127.0.0.1" port="%s" password="secret"/>' % (i, server.port))
+        for i, server in enumerate(fb):
+            xml.append('<server name="f%s" group="bf,all" game="bf3" host="127.0.0.1" port="%s" password="secret"/>' % (i, server.port))
+        xml.append('<server name="wrong" game="urt42" host="127.0.0.1" port="%s" password="secret"/>' % wrong.port)
+        xml.append('<server name="down" game="urt42" host="127.0.0.1" port="%s" password="secret"/>' % down.getsockname()[1])
+        xml.append('<cron name="announce" servers="all" minutes="0"><rcon>say "hello"</rcon><rcon>say "world"</rcon>'
+            '<frostbite command="admin.say"><arg>hello</arg><arg>all</arg></frostbite></cron>')
+        xml.append('<cron name="broken" servers="wrong,down" minutes="0"><rcon>say "hello"</rcon></cron>')
+        xml.append('</configuration>')
+        conf = XmlConfigParser()
+        conf.setXml(''.join(xml))
+        p = new_plugin(conf, VirtualClock(time.time()), 'urt41')
+        p.onLoadConfig()
+        tasks = dict([(t.name, t) for t in p._tasks])
+        results = {}
+        for name in ('announce', 'announce', 'broken', 'broken', 'broken'):
+            start = time.time()
+            sent = tasks[name].stats.commands_ok
+            results[name] = tasks[name].runcommands()
+            print "task %s : %.3fs (%.3fs one server after the other)" % (name, time.time() - start,
+                (tasks[name].stats.commands_ok - sent) * delay)
+        servers = p._fleet.servers
+        for name, server in sorted(servers.items()):
+            s = server.stats
+            print "  %-6s : %s ok %s failed, p50 %.3fs%s" % (name, s.commands_ok, s.commands_failed,
+                s.latency.percentile(50), server.lastError and ', ' + server.lastError or '')
+        print "commands received : %s rcon, %s frostbite, %s frostbite logins, %s connections open" % (
+            sum([len(x.received) for x in q3]), sum([len(x.received) for x in fb]),
+            sum([x.connections for x in fb]), p._fleet.pool.opened)
+
+        failures = []
+        def check(condition, message):
+            if not condition:
+                failures.append(message)
+        check(results['announce'] and not results['broken'], "task results %r" % results)
+        for i, server in enumerate(q3):
+            check(server.received == ['say "hello"', 'say "world"'] * 2, "q%s received %r" % (i, server.received))
+            check(servers['q%s' % i].stats.commands_ok == 4, "q%s : %s commands ok" % (i, servers['q%s' % i].stats.commands_ok))
+        for i, server in enumerate(fb):
+            check(server.received == [['admin.say', 'hello', 'all']] * 2, "f%s received %r" % (i, server.received))
+            check(server.connections == 1, "f%s : %s connections for 2 runs" % (i, server.connections))
+        for name, server in servers.items():
+            if name not in ('wrong', 'down'):
+                check(server.lastError is None and not server.stats.commands_failed, "%s failed : %s" % (name, server.lastError))
+                check(not server.link.breaker.failures, "%s breaker counted failures" % name)
+        # the server answered : a wrong password is a failure, not a reason to stop sending
+        check(servers['wrong'].stats.commands_failed == 3, "wrong : %s commands failed" % servers['wrong'].stats.commands_failed)
+        check('rconpassword' in "%s" % servers['wrong'].lastError, "wrong : last error %s" % servers['wrong'].lastError)
+        check(not servers['wrong'].link.breaker.isOpen(), "wrong : circuit open")
+        # the down server trips its own circuit after 2 timeouts, and nothing else.
+        # The third command is not even sent
+        check(servers['down'].stats.commands_failed == 3, "down : %s commands failed" % servers['down'].stats.commands_failed)
+        check(servers['down'].link.breaker.isOpen(), "down : circuit not open")
+        check('unreachable' in "%s" % servers['down'].lastError, "down : last error %s" % servers['down'].lastError)
+        check(not p._link.breaker.isOpen() and not p._link.breaker.failures, "game server breaker tripped by the fleet")
+        check(p._fleet.pool.opened <= n * 2, "%s connections open, fleet_connections is %s" % (p._fleet.pool.opened, n * 2))
+        return failures
+
+    def pop_option(name):
+        if name not in sys.argv[:-1]:
+            return None
+        i = sys.argv.index(name)
+        value = sys.argv[i + 1]
+        del sys.argv[i:i + 2]
+        return value
+
+    # the game of the console, guessed from the config by default
+    game = pop_option('--game')
+
+    if sys.argv[1:2] == ['fleet']:
+        fakeConsole.log.setLevel(logging.WARNING)
+        failures = fleet(len(sys.argv) > 2 and int(sys.argv[2]) or 10)
+        for failure in failures:
+            print "FAILED %s" % failure
+        sys.stdout.flush()
+        os._exit(failures and 1 or 0)
+
+    if sys.argv[1:2] == ['simulate']:
+        fakeConsole.log.setLevel(logging.WARNING)
+        simulate(sys.argv[2], len(sys.argv) > 3 and int(sys.argv[3]) or 30, game)
+        sys.stdout.flush()
+        os._exit(0)
+
+    if sys.argv[1:2] == ['bench']:
+        fakeConsole.log.setLevel(logging.WARNING)
+        # fail when a metric is above --max-<metric> value (ie: --max-tick-us 200)
+        # or above its value in the --baseline file by more than --tolerance
+        limits = {}
+        for option in [x for x in sys.argv[:-1] if x.startswith('--max-')]:
+            limits[option[6:].replace('-', '_')] = float(pop_option(option))
+        baselinePath = pop_option('--baseline')
+        tolerance = float(pop_option('--tolerance') or 0.2)
+        results = {}
+        for n in [int(x) for x in sys.argv[2:]] or [10, 1000, 10000]:
+            results[n] = bench(n, game)
+        baseline = {}
+        if baselinePath and os.path.exists(baselinePath):
+            baseline = json.load(open(baselinePath))
+        elif baselinePath:
+            atomic_write(baselinePath, json.dumps(results, indent=1, sort_keys=True))
+            print "baseline saved to %s" % baselinePath
+        failures = check_bench(results, limits, baseline, tolerance)
+        for failure in failures:
+            print "FAILED %s" % failure
+        sys.stdout.flush()
+        os._exit(failures and 1 or 0)
+
+    if sys.argv[1:2] == ['test']:
+        # checks with assertions and doctests, exit with status 1 on failure
+        import doctest, traceback
+        fakeConsole.log.setLevel(logging.WARNING)
+        failed = doctest.testmod()[0]
+        for test in (test_cron_expression, test_timezones):
+            try:
+                test()
+                print "%s : ok" % test.__name__
+            except Exception:
+                traceback.print_exc()
+                print "%s : FAILED" % test.__name__
+                failed += 1
+        sys.stdout.flush()
+        os._exit(failed and 1 or 0)
 
     #test_daily()
     #test_hourly()